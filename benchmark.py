@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DAY = 24 * 60
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def isolated(function, *args):
+    # each case runs in a fresh interpreter so peak RSS is not inherited
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(function, *args).result()
+
+
+def bench_simulation(days, trace, measure_tracemalloc=False):
+    from simulation import HospitalSimulation
+    from trace_sinks import create_trace_sink
+
+    with tempfile.TemporaryDirectory() as directory:
+        if trace:
+            kwargs = {'trace_sink': create_trace_sink(os.path.join(directory, 'trace.csv'))}
+        else:
+            kwargs = {'trace_level': 'off'}
+        if measure_tracemalloc:
+            tracemalloc.start()
+        sim = HospitalSimulation(simulation_end_time=days * DAY, **kwargs)
+        start = time.perf_counter()
+        sim.simulate()
+        wall = time.perf_counter() - start
+        events = sim.future_event_list.popped_count
+        result = {
+            'benchmark': 'simulation',
+            'days': days,
+            'trace': 'full (csv)' if trace else 'off',
+            'wall_seconds': wall,
+            'events': events,
+            'events_per_second': events / wall if wall > 0 else None
+        }
+        if measure_tracemalloc:
+            result['tracemalloc_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def bench_replications(workers, replications, days):
+    from replications import run_replications
+
+    start = time.perf_counter()
+    run_replications(replications, days * DAY, workers=workers)
+    wall = time.perf_counter() - start
+    return {
+        'benchmark': 'replications',
+        'workers': workers,
+        'replications': replications,
+        'days': days,
+        'wall_seconds': wall
+    }
+
+
+def bench_surgery_analysis():
+    start = time.perf_counter()
+    import surgerytime_dist
+    import_seconds = time.perf_counter() - start
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            # a copy of the workbook keeps its cache out of the repo; the
+            # first pass parses it (cold), the second reads the cache (warm)
+            workbook = shutil.copy2(os.path.join(REPO_DIR, 'surgery_data.xlsx'), directory)
+            walls = []
+            for _ in range(2):
+                start = time.perf_counter()
+                surgerytime_dist.analyze_surgery_data(workbook, os.path.join(directory, 'surgery_time_params.json'),
+                                                      plot_dir=directory)
+                walls.append(time.perf_counter() - start)
+        finally:
+            os.chdir(cwd)
+    return {
+        'benchmark': 'surgery_analysis',
+        'import_seconds': import_seconds,
+        'cold_wall_seconds': walls[0],
+        'warm_wall_seconds': walls[1],
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def bench_excel_export(days):
+    from simulation import HospitalSimulation
+
+    sim = HospitalSimulation(simulation_end_time=days * DAY)
+    sim.simulate()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            start = time.perf_counter()
+            sim.create_trace_excel()
+            wall = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    return {
+        'benchmark': 'excel_export',
+        'days': days,
+        'rows': len(sim.trace_table),
+        'wall_seconds': wall,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(horizons, worker_counts, replications, measure_tracemalloc=False, log=print):
+    results = []
+    for days in horizons:
+        for trace in (False, True):
+            log(f"simulation: {days} days, trace {'on' if trace else 'off'}")
+            result = isolated(bench_simulation, days, trace)
+            if measure_tracemalloc:
+                # a separate pass, since tracemalloc slows the run down
+                result['tracemalloc_peak_mb'] = isolated(bench_simulation, days, trace, True)['tracemalloc_peak_mb']
+            results.append(result)
+    for workers in worker_counts:
+        log(f"replications: {replications} x 30 days on {workers} worker(s)")
+        results.append(bench_replications(workers, replications, 30))
+    log("surgery time analysis")
+    results.append(isolated(bench_surgery_analysis))
+    log("excel export: 30 days")
+    results.append(isolated(bench_excel_export, 30))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark simulation throughput and memory")
+    parser.add_argument('--horizons', default='30,365,1825', help="comma-separated horizons in days")
+    parser.add_argument('--workers', default=None,
+                        help="comma-separated worker counts for the replication scaling test "
+                             "(default: 1, 2, 4, ... up to the number of CPUs)")
+    parser.add_argument('--replications', type=int, default=8)
+    parser.add_argument('--tracemalloc', action='store_true', help="also record the tracemalloc peak")
+    parser.add_argument('--quick', action='store_true', help="30 days and 1 year only")
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    horizons = [30, 365] if args.quick else [int(days) for days in args.horizons.split(',')]
+    if args.workers:
+        worker_counts = [int(workers) for workers in args.workers.split(',')]
+    else:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= (os.cpu_count() or 1):
+            worker_counts.append(worker_counts[-1] * 2)
+
+    results = run_benchmarks(horizons, worker_counts, args.replications, args.tracemalloc,
+                             log=lambda message: print(message, file=sys.stderr))
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
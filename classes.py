@@ -1,17 +1,26 @@
 import random
 import math
+import zlib
+import heapq
+from collections import deque
+from itertools import chain
+
+import numpy as np
 
 
 class Distributions:
     def __init__(self, seed=100):
-        random.seed(seed)
+        self.rng = random.Random(seed)
+    
+    def random(self):
+        return self.rng.random()
         
     def uniform_dist(self, a, b):
-        r = random.random()
+        r = self.rng.random()
         return a + int(r * (b - a + 1))
     
     def triangular_dist(self, min_val, mode, max_val):
-        r = random.random()
+        r = self.rng.random()
         if r < (mode - min_val) / (max_val - min_val):
             return min_val + math.sqrt((mode - min_val) * (max_val - min_val) * r)
         else:
@@ -19,39 +28,345 @@ class Distributions:
     
     def exponential_dist(self, mean_minutes):
         lambda_param = 1 / mean_minutes
-        r = random.random()
+        r = self.rng.random()
         time_minutes = -math.log(r) / lambda_param
         return time_minutes
     
     def normal_dist(self, mu, sigma):
-        r1 = random.random()
-        r2 = random.random()
+        r1 = self.rng.random()
+        r2 = self.rng.random()
         z = math.sqrt(-2 * math.log(r1)) * math.cos(2 * math.pi * r2)
         return mu + sigma * z
+    
+    def lognormal_dist(self, mu, sigma):
+        return math.exp(self.normal_dist(mu, sigma))
+    
+    def gamma_dist(self, shape, scale):
+        return self.rng.gammavariate(shape, scale)
+    
+    def weibull_dist(self, shape, scale):
+        r = self.rng.random()
+        return scale * (-math.log(r)) ** (1 / shape)
+    
+    def empirical_dist(self, quantiles):
+        # inverse CDF lookup: quantiles are equally spaced in probability
+        position = self.rng.random() * (len(quantiles) - 1)
+        i = int(position)
+        return quantiles[i] + (position - i) * (quantiles[i + 1] - quantiles[i])
 
-dist = Distributions()
+class VariateBuffer:
+    __slots__ = ('generate', 'args', 'block_size', 'values')
 
-class powerout:
-    count = 0
+    def __init__(self, generate, args, block_size):
+        # generate is a numpy Generator method, kept with its arguments rather
+        # than as a closure so that buffers can be pickled into checkpoints
+        self.generate = generate
+        self.args = args
+        self.block_size = block_size
+        self.values = []
+
+    def next(self):
+        try:
+            return self.values.pop()
+        except IndexError:
+            # reversed so that pop() hands the block out in generation order
+            self.values = self.generate(*self.args, size=self.block_size)[::-1].tolist()
+            return self.values.pop()
+
+class BufferedDistributions:
+    # same interface as Distributions, but variates are generated by numpy in
+    # blocks, one block per distribution and parameter set
+    def __init__(self, seed=100, block_size=4096):
+        self.generator = np.random.default_rng(seed)
+        self.block_size = block_size
+        self.random_buffer = VariateBuffer(self.generator.random, (), block_size)
+        self.uniform_buffers = {}
+        self.triangular_buffers = {}
+        self.exponential_buffers = {}
+        self.normal_buffers = {}
+        self.lognormal_buffers = {}
+        self.gamma_buffers = {}
+        self.weibull_buffers = {}
+
+    def random(self):
+        return self.random_buffer.next()
+
+    def uniform_dist(self, a, b):
+        try:
+            return self.uniform_buffers[a, b].next()
+        except KeyError:
+            buffer = VariateBuffer(self.generator.integers, (a, b + 1), self.block_size)
+            self.uniform_buffers[a, b] = buffer
+            return buffer.next()
+
+    def triangular_dist(self, min_val, mode, max_val):
+        try:
+            return self.triangular_buffers[min_val, mode, max_val].next()
+        except KeyError:
+            buffer = VariateBuffer(self.generator.triangular, (min_val, mode, max_val), self.block_size)
+            self.triangular_buffers[min_val, mode, max_val] = buffer
+            return buffer.next()
+
+    def exponential_dist(self, mean_minutes):
+        try:
+            return self.exponential_buffers[mean_minutes].next()
+        except KeyError:
+            buffer = VariateBuffer(self.generator.exponential, (mean_minutes,), self.block_size)
+            self.exponential_buffers[mean_minutes] = buffer
+            return buffer.next()
+
+    def normal_dist(self, mu, sigma):
+        try:
+            return self.normal_buffers[mu, sigma].next()
+        except KeyError:
+            buffer = VariateBuffer(self.generator.normal, (mu, sigma), self.block_size)
+            self.normal_buffers[mu, sigma] = buffer
+            return buffer.next()
+
+    def lognormal_dist(self, mu, sigma):
+        try:
+            return self.lognormal_buffers[mu, sigma].next()
+        except KeyError:
+            buffer = VariateBuffer(self.generator.lognormal, (mu, sigma), self.block_size)
+            self.lognormal_buffers[mu, sigma] = buffer
+            return buffer.next()
+
+    def gamma_dist(self, shape, scale):
+        try:
+            return self.gamma_buffers[shape, scale].next()
+        except KeyError:
+            buffer = VariateBuffer(self.generator.gamma, (shape, scale), self.block_size)
+            self.gamma_buffers[shape, scale] = buffer
+            return buffer.next()
+
+    def weibull_dist(self, shape, scale):
+        # numpy's weibull has unit scale, so one buffer serves every scale
+        try:
+            return scale * self.weibull_buffers[shape].next()
+        except KeyError:
+            buffer = VariateBuffer(self.generator.weibull, (shape,), self.block_size)
+            self.weibull_buffers[shape] = buffer
+            return scale * buffer.next()
+
+    def empirical_dist(self, quantiles):
+        position = self.random_buffer.next() * (len(quantiles) - 1)
+        i = int(position)
+        return quantiles[i] + (position - i) * (quantiles[i + 1] - quantiles[i])
+
+RANDOM_STREAMS = (
+    'elective_arrival',
+    'nonelective_arrival',
+    'group_arrival',
+    'lab_time',
+    'before_surgery_time',
+    'surgery_type',
+    'surgery_time',
+    'death',
+    'routing',
+    'bedridden_time',
+    'resurgery',
+    'power_outage'
+)
+
+def stream_seed(seed, name):
+    # derived from the stream name rather than its position, so adding a
+    # stream never shifts the draws of the others
+    sequence = np.random.SeedSequence([seed, zlib.crc32(name.encode())])
+    return int(sequence.generate_state(1, dtype=np.uint64)[0])
+
+def arrival_times(generator, mean, end_time):
+    # cumulative sums of exponential interarrival times, drawn in blocks
+    # until the horizon is covered, cut at end_time
+    expected = end_time / mean
+    size = int(expected + 6 * math.sqrt(expected)) + 16
+    times = np.cumsum(generator.exponential(mean, size))
+    while times[-1] < end_time:
+        times = np.concatenate((times, times[-1] + np.cumsum(generator.exponential(mean, size))))
+    return times[:np.searchsorted(times, end_time)]
+
+class Timeline:
+    # pre-generated event times in ascending order, each with an optional
+    # value, handed to the event calendar one at a time through a cursor
+    __slots__ = ('times', 'values', 'cursor')
+
+    def __init__(self, times, values=None):
+        self.times = np.asarray(times).tolist()
+        self.values = np.asarray(values).tolist() if values is not None else [None] * len(self.times)
+        self.cursor = 0
+
+    def next(self):
+        # (time, value) of the next event, or None once exhausted
+        if self.cursor == len(self.times):
+            return None
+        i = self.cursor
+        self.cursor += 1
+        return self.times[i], self.values[i]
+
+    def __len__(self):
+        return len(self.times)
+
+class RandomStreams:
+    def __init__(self, seed=100, backend='scalar', independent=True):
+        if backend == 'scalar':
+            distribution_class = Distributions
+        elif backend == 'buffered':
+            distribution_class = BufferedDistributions
+        else:
+            raise ValueError(f"rng_backend must be 'scalar' or 'buffered', got {backend!r}")
+        
+        if independent:
+            # one stream per stochastic process (common random numbers)
+            for name in RANDOM_STREAMS:
+                setattr(self, name, distribution_class(stream_seed(seed, name)))
+        else:
+            # every process shares one stream, as in the original model
+            shared = distribution_class(seed)
+            for name in RANDOM_STREAMS:
+                setattr(self, name, shared)
+
+class Event:
+    __slots__ = ('time', 'code', 'patient_id', 'extra_data')
+
+    def __init__(self, time, code, patient_id=None, extra_data=None):
+        self.time = time
+        self.code = code
+        self.patient_id = patient_id
+        self.extra_data = extra_data
+
+class EventCalendar:
     def __init__(self):
-        powerout.count += 1
+        self._heap = []
+        self._sequence = 0
+
+    def push(self, event):
+        # sequence number keeps events with equal times in FIFO order
+        heapq.heappush(self._heap, (event.time, self._sequence, event))
+        self._sequence += 1
+
+    def pop(self):
+        return heapq.heappop(self._heap)[2]
+
+    @property
+    def popped_count(self):
+        # events taken off the calendar so far
+        return self._sequence - len(self._heap)
+
+    def __getitem__(self, index):
+        if index != 0:
+            raise IndexError("only the next event can be peeked")
+        return self._heap[0][2]
 
-    @classmethod
-    def time(cls):
-        r = dist.uniform_dist(1, 30)
-        start_time = (cls.count * 30 + (r-1)) * 24 * 60
+    def __len__(self):
+        return len(self._heap)
+
+    def __bool__(self):
+        return bool(self._heap)
+
+class DepartmentQueue:
+    def __init__(self):
+        # priority patients are always served before regular ones,
+        # each lane is first in first out
+        self.priority_lane = deque()
+        self.regular_lane = deque()
+        # running sum of enter times so the total wait is O(1), with a
+        # Neumaier compensation term holding the rounding error of the sum;
+        # a queue that never empties would otherwise drift over long runs
+        self.sum_enter_time = 0
+        self.sum_compensation = 0
+
+    def append(self, entry):
+        if entry['priority']:
+            self.priority_lane.append(entry)
+        else:
+            self.regular_lane.append(entry)
+        self.add_enter_time(entry['enter_time'])
+
+    def popleft(self):
+        if self.priority_lane:
+            entry = self.priority_lane.popleft()
+        else:
+            entry = self.regular_lane.popleft()
+        if self:
+            self.add_enter_time(-entry['enter_time'])
+        else:
+            self.sum_enter_time = 0
+            self.sum_compensation = 0
+        return entry
+
+    def add_enter_time(self, value):
+        total = self.sum_enter_time + value
+        if abs(self.sum_enter_time) >= abs(value):
+            self.sum_compensation += (self.sum_enter_time - total) + value
+        else:
+            self.sum_compensation += (value - total) + self.sum_enter_time
+        self.sum_enter_time = total
+
+    def total_wait(self, clock):
+        return (len(self) * clock - self.sum_enter_time) - self.sum_compensation
+
+    def __iter__(self):
+        return chain(self.priority_lane, self.regular_lane)
+
+    def __len__(self):
+        return len(self.priority_lane) + len(self.regular_lane)
+
+    def __bool__(self):
+        return bool(self.priority_lane) or bool(self.regular_lane)
+
+class TimeWeightedStat:
+    def __init__(self):
+        self.integral = 0
+        self.total_time = 0
+        self.max = 0
+        self.last = 0
+        self.start_window()
+
+    def update(self, time_delta, value):
+        weighted = time_delta * value
+        self.integral += weighted
+        self.total_time += time_delta
+        if value > self.max:
+            self.max = value
+        self.last = value
+        self.window_integral += weighted
+        self.window_time += time_delta
+        if value > self.window_max:
+            self.window_max = value
+
+    def mean(self):
+        return self.integral / self.total_time if self.total_time > 0 else 0
+
+    def start_window(self):
+        self.window_integral = 0
+        self.window_time = 0
+        self.window_max = self.last
+
+    def window_mean(self):
+        return self.window_integral / self.window_time if self.window_time > 0 else self.last
+
+class powerout:
+    def __init__(self, count, dist):
+        self.count = count
+        self.dist = dist
+
+    def time(self):
+        r = self.dist.uniform_dist(1, 30)
+        start_time = (self.count * 30 + (r-1)) * 24 * 60
         finish_time = start_time + 24 * 60
         return start_time, finish_time
 
 class Patient:
-    id = 0
-    def __init__(self):
-        self.id = Patient.id
-        Patient.id += 1
+    __slots__ = ('id', 'paperwork_time', 'in_lab_time', 'before_surgery_time', 'surgery_time', 'surgery_type',
+                 'bedriddentime', 'transfer_location', 'service', 'arrival_time')
+
+    def __init__(self, patient_id):
+        self.id = patient_id
 
 class NoneElective(Patient):
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
+
+    def __init__(self, patient_id):
+        super().__init__(patient_id)
         self.paperwork_time = 10
         self.in_lab_time = None
         self.before_surgery_time = None
@@ -61,8 +376,10 @@ class NoneElective(Patient):
         self.transfer_location = None
 
 class Elective(Patient):
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
+
+    def __init__(self, patient_id):
+        super().__init__(patient_id)
         self.paperwork_time = 60
         self.in_lab_time = None
         self.before_surgery_time = None
@@ -71,41 +388,90 @@ class Elective(Patient):
         self.bedriddentime = None
         self.transfer_location = None
 
-class Emergency:
-    available_beds = 10
-    queue = 0
+class CompletedPatients:
+    # columnar store of patients that have left the system
+    PATIENT_TYPES = ('Elective', 'Non-Elective', 'Group Non-Elective')
+    SURGERY_TYPES = ('simple', 'moderate', 'complex')
+    OUTCOMES = ('Discharged', 'Died')
+
+    def __init__(self, initial_capacity=1024):
+        self.size = 0
+        self.columns = {
+            'patient_id': np.empty(initial_capacity, dtype=np.int64),
+            'entry_time': np.empty(initial_capacity, dtype=np.float64),
+            'departure_time': np.empty(initial_capacity, dtype=np.float64),
+            'patient_type': np.empty(initial_capacity, dtype=np.int8),
+            'surgery_type': np.empty(initial_capacity, dtype=np.int8),
+            'outcome': np.empty(initial_capacity, dtype=np.int8)
+        }
 
-class PreSurgery:
-    available_beds = 50
-    queue = 0
+    def append(self, patient_id, stats, outcome):
+        if self.size == len(self.columns['patient_id']):
+            for name, column in self.columns.items():
+                grown = np.empty(2 * len(column), dtype=column.dtype)
+                grown[:self.size] = column
+                self.columns[name] = grown
+        index = self.size
+        self.columns['patient_id'][index] = patient_id
+        self.columns['entry_time'][index] = stats['system_entry_time']
+        self.columns['departure_time'][index] = stats['departure_time']
+        self.columns['patient_type'][index] = self.PATIENT_TYPES.index(stats['patient_type'])
+        self.columns['surgery_type'][index] = self.SURGERY_TYPES.index(stats['surgery_type'])
+        self.columns['outcome'][index] = self.OUTCOMES.index(outcome)
+        self.size += 1
 
-class Labratory:
-    available_beds = 3
-    queue = 0
+    def __getitem__(self, name):
+        return self.columns[name][:self.size]
 
-class OperatingRoom:
-    available_beds = 50
-    queue = 0
+    def __len__(self):
+        return self.size
 
-class ICU:
-    available_beds = 15
-    queue = 0
+    def total_time_in_system(self):
+        # summed in patient id order, the order patient_stats used to be walked in
+        order = np.argsort(self['patient_id'], kind='stable')
+        return sum((self['departure_time'] - self['entry_time'])[order].tolist())
 
-class CCU:
-    available_beds = 20
-    queue = 0
+class Department:
+    capacity = 0
 
-class Ward:
-    available_beds = 100
-    queue = 0
+    def __init__(self, capacity=None):
+        if capacity is not None:
+            self.capacity = capacity
+        self.available_beds = self.capacity
+        self.queue = 0
+
+    @property
+    def busy_beds(self):
+        return self.capacity - self.available_beds
+
+class Emergency(Department):
+    capacity = 10
+
+class PreSurgery(Department):
+    capacity = 50
+
+class Labratory(Department):
+    capacity = 3
+
+class OperatingRoom(Department):
+    capacity = 50
+
+class ICU(Department):
+    capacity = 15
+
+class CCU(Department):
+    capacity = 20
+
+class Ward(Department):
+    capacity = 100
 
 class GroupEnterance:
-    def __init__(self):
-        self.number = dist.uniform_dist(2, 5)
-        self.group_arrival_time = self.clock if hasattr(self, 'clock') else 0
+    def __init__(self, dist, create_patient, arrival_time=0, number=None):
+        self.number = number if number is not None else dist.uniform_dist(2, 5)
+        self.group_arrival_time = arrival_time
         self.patients = []
         
         for _ in range(self.number):
-            patient = NoneElective()
+            patient = create_patient(NoneElective)
             patient.arrival_time = self.group_arrival_time
             self.patients.append(patient)
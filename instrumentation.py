@@ -0,0 +1,213 @@
+import sys
+import time
+
+
+OBSERVER_HOOKS = ('event', 'queue_entry', 'queue_exit', 'bed_seize', 'bed_release')
+
+# simulation methods the profiler times, besides the per-event-type dispatch
+PROFILED_METHODS = (
+    'update_statistics',
+    'record_trace',
+    'assign_patient_times',
+    'create_patient',
+    'add_to_queue',
+    'remove_from_queue',
+    'start_surgery',
+    'check_or_queue',
+    'process_discharge',
+    'release_patient'
+)
+
+
+class ObservedHandler:
+    # dispatch table entry installed only while 'event' observers exist
+    def __init__(self, sim, handler):
+        self.sim = sim
+        self.handler = handler
+
+    def __call__(self, patient_id):
+        for callback in self.sim.observers['event']:
+            callback(self.sim, self.sim.current_event)
+        return self.handler(patient_id)
+
+
+class ObservedQueueEntry:
+    def __init__(self, sim, method):
+        self.sim = sim
+        self.method = method
+
+    def __call__(self, department, patient_id, priority=False):
+        self.method(department, patient_id, priority)
+        for callback in self.sim.observers['queue_entry']:
+            callback(self.sim, department, patient_id)
+
+
+class ObservedQueueExit:
+    def __init__(self, sim, method):
+        self.sim = sim
+        self.method = method
+
+    def __call__(self, department):
+        patient_id, wait_time = self.method(department)
+        if patient_id is not None:
+            for callback in self.sim.observers['queue_exit']:
+                callback(self.sim, department, patient_id, wait_time)
+        return patient_id, wait_time
+
+
+class ObservedDepartment:
+    # Stands in for a department while bed observers exist. Every decrease
+    # of available_beds is reported as a seize and every increase as a
+    # release, including the caps applied during power outages.
+    def __init__(self, sim, name, department):
+        self.sim = sim
+        self.name = name
+        self.department = department
+        self.capacity = department.capacity
+        self.queue = department.queue
+        self._available_beds = department.available_beds
+
+    @property
+    def available_beds(self):
+        return self._available_beds
+
+    @available_beds.setter
+    def available_beds(self, value):
+        change = value - self._available_beds
+        self._available_beds = value
+        if change < 0:
+            for callback in self.sim.observers['bed_seize']:
+                callback(self.sim, self.name, -change)
+        elif change > 0:
+            for callback in self.sim.observers['bed_release']:
+                callback(self.sim, self.name, change)
+
+    @property
+    def busy_beds(self):
+        return self.capacity - self._available_beds
+
+    def restore(self):
+        self.department.available_beds = self._available_beds
+        self.department.queue = self.queue
+        return self.department
+
+
+class CallStats:
+    __slots__ = ('count', 'total_ns')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+
+
+class TimedEvent:
+    def __init__(self, profiler, sim, name, handler):
+        self.profiler = profiler
+        self.sim = sim
+        self.stats = profiler.events.setdefault(name, CallStats())
+        self.handler = handler
+
+    def __call__(self, patient_id):
+        if self.sim.clock >= self.profiler.next_sample_time:
+            self.profiler.sample_calendar(self.sim)
+        start = time.perf_counter_ns()
+        try:
+            return self.handler(patient_id)
+        finally:
+            self.stats.total_ns += time.perf_counter_ns() - start
+            self.stats.count += 1
+
+
+class TimedMethod:
+    def __init__(self, stats, method):
+        self.stats = stats
+        self.method = method
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return self.method(*args, **kwargs)
+        finally:
+            self.stats.total_ns += time.perf_counter_ns() - start
+            self.stats.count += 1
+
+
+class Profiler:
+    # call counts and cumulative perf_counter_ns per event type and per
+    # simulation method, plus the event calendar size sampled every
+    # calendar_sample_interval minutes of simulated time
+    def __init__(self, calendar_sample_interval=60):
+        self.calendar_sample_interval = calendar_sample_interval
+        self.next_sample_time = 0
+        self.events = {}
+        self.handlers = {}
+        self.calendar_sizes = []
+
+    def sample_calendar(self, sim):
+        self.calendar_sizes.append((sim.clock, len(sim.future_event_list)))
+        while self.next_sample_time <= sim.clock:
+            self.next_sample_time += self.calendar_sample_interval
+
+    def report(self):
+        def table(entries):
+            return {
+                name: {
+                    'calls': stats.count,
+                    'total_ms': stats.total_ns / 1e6,
+                    'mean_us': stats.total_ns / stats.count / 1e3 if stats.count else 0
+                }
+                for name, stats in sorted(entries.items(), key=lambda item: -item[1].total_ns)
+            }
+        sizes = [size for _, size in self.calendar_sizes]
+        return {
+            'events': table(self.events),
+            'handlers': table(self.handlers),
+            'calendar_size': {
+                'samples': len(sizes),
+                'mean': sum(sizes) / len(sizes) if sizes else 0,
+                'max': max(sizes) if sizes else 0
+            }
+        }
+
+    def print_report(self):
+        report = self.report()
+        for section in ('events', 'handlers'):
+            print(f"\n{section.capitalize():<30}{'Calls':>12}{'Total ms':>14}{'Mean us':>12}")
+            for name, row in report[section].items():
+                print(f"{name:<30}{row['calls']:>12}{row['total_ms']:>14.2f}{row['mean_us']:>12.2f}")
+        calendar = report['calendar_size']
+        print(f"\nEvent calendar size: mean {calendar['mean']:.1f}, max {calendar['max']} "
+              f"({calendar['samples']} samples)")
+
+
+class ProgressReporter:
+    # progress callback for HospitalSimulation.simulate(progress=...):
+    # prints simulated days, events per second and the estimated time left
+    # at most every `interval` seconds of wall time
+    def __init__(self, interval=1.0, file=None):
+        self.interval = interval
+        self.file = file
+        self.start = None
+        self.last_report = 0
+
+    def __call__(self, sim):
+        now = time.perf_counter()
+        events = sim.future_event_list.popped_count
+        if self.start is None:
+            self.start = now
+            self.start_events = events
+            self.start_clock = sim.clock
+            self.last_report = now
+            return
+        if now - self.last_report < self.interval and not sim.finished:
+            return
+        self.last_report = now
+        elapsed = now - self.start
+        events_per_second = (events - self.start_events) / elapsed if elapsed > 0 else 0
+        simulated = sim.clock - self.start_clock
+        remaining = max(sim.simulation_end_time - sim.clock, 0)
+        eta = f"{remaining * elapsed / simulated:.1f}s" if simulated > 0 else '?'
+        day = 24 * 60
+        print(f"day {sim.clock / day:.1f}/{sim.simulation_end_time / day:.0f} "
+              f"({sim.clock / sim.simulation_end_time:.0%}), {events} events, "
+              f"{events_per_second:,.0f} events/s, ETA {eta}", file=self.file or sys.stderr)
@@ -1,8 +1,102 @@
-from simulation import HospitalSimulation
+import argparse
+import json
+import signal
 
-if __name__ == "__main__":
-    #doing the simulaton for 30 days
-    sim = HospitalSimulation(simulation_end_time=43200)
-    trace_df = sim.run()
+from instrumentation import ProgressReporter
+from scenarios import LEGACY_SURGERY_TIME_PARAMS
+from simulation import SURGERY_TIME_MODELS, HospitalSimulation
+from trace_sinks import TRACE_LEVELS, create_trace_sink
+
+TRACE_FORMATS = ('xlsx', 'csv', 'parquet')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the hospital simulation")
+    parser.add_argument('--days', type=float, default=30, help="simulation horizon in days")
+    parser.add_argument('--seed', type=int, default=100)
+    parser.add_argument('--replications', type=int, default=1,
+                        help="more than 1 runs independent replications and reports confidence intervals")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes for replications")
+    parser.add_argument('--warmup-days', type=float, default=0,
+                        help="statistics collected before this time are discarded")
+    parser.add_argument('--surgery-times', choices=SURGERY_TIME_MODELS, default='fitted',
+                        help="sample surgery durations from the fitted distribution or the empirical/KDE tables")
+    parser.add_argument('--legacy', action='store_true',
+                        help="use the original rounded surgery time fits and single random stream, "
+                             "which reproduce the traces of earlier versions")
+    parser.add_argument('--pregenerate', action='store_true',
+                        help="generate all arrivals and power outages up front with numpy")
+    parser.add_argument('--trace', choices=TRACE_LEVELS, default='full', help="trace level of a single run")
+    parser.add_argument('--trace-bucket', type=float, default=60,
+                        help="minutes per row of the aggregate trace, e.g. 60 (hourly) or 1440 (daily)")
+    parser.add_argument('--trace-events', default=None, metavar='TYPE,...',
+                        help="only record rows for these event types, e.g. 'Surgery End,ICU Discharge'")
+    parser.add_argument('--trace-patients', default=None, metavar='ID,...',
+                        help="only record rows for events of these patient ids")
+    parser.add_argument('--format', choices=TRACE_FORMATS, default='xlsx',
+                        help="trace file format; the trace is streamed to disk during the run")
+    parser.add_argument('--output', default=None,
+                        help="trace file (default: hospital_simulation_trace.<format>)")
+    parser.add_argument('--json', action='store_true', help="print the statistics as JSON")
+    parser.add_argument('--progress', action='store_true', help="report events/sec and the ETA on stderr")
+    args = parser.parse_args(argv)
+    if args.legacy and (args.replications > 1 or args.surgery_times != 'fitted' or args.pregenerate):
+        parser.error("--legacy reproduces a single run of the original model; it cannot be combined with "
+                     "--replications, --surgery-times or --pregenerate")
+    return args
+
+
+def run_single(args):
+    end_time = args.days * 24 * 60
+    output = args.output or f'hospital_simulation_trace.{args.format}'
+    kwargs = {}
+    if args.legacy:
+        kwargs.update(surgery_time_params=LEGACY_SURGERY_TIME_PARAMS, rng_streams='shared')
+    if args.trace != 'off':
+        kwargs['trace_sink'] = create_trace_sink(output)
+    sim = HospitalSimulation(simulation_end_time=end_time, seed=args.seed, trace_level=args.trace,
+                             warmup_time=args.warmup_days * 24 * 60, surgery_time_model=args.surgery_times,
+                             trace_bucket=args.trace_bucket, pregenerate_arrivals=args.pregenerate,
+                             trace_event_types=args.trace_events.split(',') if args.trace_events else None,
+                             trace_patient_ids=([int(i) for i in args.trace_patients.split(',')]
+                                                if args.trace_patients else None),
+                             **kwargs)
+    
+    def interrupt(signum, frame):
+        # the first Ctrl-C ends the run after the current event and still
+        # reports the statistics so far; a second one aborts
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        sim.stop()
     
-    print("SIMULATION COMPLETED SUCCESSFULLY")
\ No newline at end of file
+    signal.signal(signal.SIGINT, interrupt)
+    sim.simulate(progress=ProgressReporter() if args.progress else None)
+    sim.close()
+    if args.json:
+        print(json.dumps(sim.compute_statistics(), indent=2))
+    else:
+        sim.print_statistics()
+    return sim
+
+
+def run_many(args):
+    # imported here so a single run does not load scipy
+    from replications import print_summary, run_replications
+
+    results, summary = run_replications(args.replications, args.days * 24 * 60, args.seed, args.workers,
+                                        warmup_time=args.warmup_days * 24 * 60, surgery_time_model=args.surgery_times,
+                                        pregenerate_arrivals=args.pregenerate)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    return summary
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.replications > 1:
+        run_many(args)
+    else:
+        run_single(args)
+
+    print("SIMULATION COMPLETED SUCCESSFULLY")
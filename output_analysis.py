@@ -0,0 +1,126 @@
+import math
+
+import numpy as np
+from scipy import stats
+
+
+def mser5(series):
+    # MSER-5: average the series in batches of 5 and delete the prefix that
+    # minimises the squared standard error of the remaining batch means.
+    # Only the first half is considered, as recommended for the method.
+    # Returns the number of observations to delete.
+    values = np.asarray(series, dtype=float)
+    n_batches = len(values) // 5
+    if n_batches < 2:
+        return 0
+    batches = values[:n_batches * 5].reshape(n_batches, 5).mean(axis=1)
+    suffix_sum = np.cumsum(batches[::-1])[::-1]
+    suffix_sq = np.cumsum((batches ** 2)[::-1])[::-1]
+    remaining = np.arange(n_batches, 0, -1)
+    squared_error = (suffix_sq - suffix_sum ** 2 / remaining) / remaining ** 2
+    best = int(np.argmin(squared_error[:max(1, n_batches // 2)]))
+    return best * 5
+
+
+def welch_moving_average(series, window=5):
+    # Welch's moving average with the shorter symmetric window at the start
+    values = np.asarray(series, dtype=float)
+    smoothed = np.empty(len(values))
+    for i in range(len(values)):
+        half = min(i, window, len(values) - 1 - i)
+        smoothed[i] = values[i - half:i + half + 1].mean()
+    return smoothed
+
+
+def welch_warmup(series, window=5, tolerance=0.05):
+    # first point where the moving average reaches the tolerance band around
+    # the mean of the second half of the run
+    smoothed = welch_moving_average(series, window)
+    if len(smoothed) < 2:
+        return 0
+    steady = smoothed[len(smoothed) // 2:].mean()
+    band = tolerance * abs(steady) if steady != 0 else tolerance
+    inside = np.nonzero(np.abs(smoothed - steady) <= band)[0]
+    return int(inside[0]) if len(inside) else len(smoothed) // 2
+
+
+def detect_warmup(series, method='mser5', **kwargs):
+    if method == 'mser5':
+        return mser5(series)
+    if method == 'welch':
+        return welch_warmup(series, **kwargs)
+    raise ValueError(f"Unknown warm-up method: {method}")
+
+
+def batch_means(series, num_batches=20, confidence=0.95):
+    # groups the series into num_batches equal batches, dropping the oldest
+    # leftover observations, and returns the mean with its t half-width
+    values = np.asarray(series, dtype=float)
+    batch_size = len(values) // num_batches
+    if batch_size == 0 or num_batches < 2:
+        return float(values.mean()) if len(values) else float('nan'), float('inf')
+    values = values[len(values) - batch_size * num_batches:]
+    means = values.reshape(num_batches, batch_size).mean(axis=1)
+    mean = float(means.mean())
+    t_value = float(stats.t.ppf((1 + confidence) / 2, num_batches - 1))
+    half_width = t_value * float(means.std(ddof=1)) / math.sqrt(num_batches)
+    return mean, half_width
+
+
+class SequentialStopping:
+    # Collects one time-weighted observation per KPI every batch_length
+    # minutes of simulated time. Once min_observations are available it
+    # truncates the warm-up on each series and stops the run when every
+    # KPI's batch-means half-width is within relative_precision of its mean.
+    def __init__(self, sim, kpis, relative_precision=0.05, batch_length=24 * 60, confidence=0.95,
+                 num_batches=20, min_observations=100, warmup_method='mser5'):
+        self.sim = sim
+        self.kpis = list(kpis)
+        self.relative_precision = relative_precision
+        self.batch_length = batch_length
+        self.confidence = confidence
+        self.num_batches = num_batches
+        self.min_observations = min_observations
+        self.warmup_method = warmup_method
+        self.series = {kpi: [] for kpi in self.kpis}
+        self.times = []
+        self.estimates = {}
+        self.converged = False
+        self.code = sim.register_event_type('Batch End', self.process_batch_end)
+        sim.schedule_event(self.code, sim.clock + batch_length)
+
+    def process_batch_end(self, patient_id=None):
+        snapshot = self.sim.snapshot_statistics()
+        for kpi in self.kpis:
+            self.series[kpi].append(snapshot[kpi])
+        self.times.append(self.sim.clock)
+        self.sim.schedule_event(self.code, self.sim.clock + self.batch_length)
+        if len(self.times) >= self.min_observations and self.evaluate():
+            self.converged = True
+            self.sim.stop()
+
+    def evaluate(self):
+        precise = True
+        for kpi in self.kpis:
+            series = self.series[kpi]
+            cutoff = detect_warmup(series, self.warmup_method)
+            mean, half_width = batch_means(series[cutoff:], self.num_batches, self.confidence)
+            self.estimates[kpi] = {
+                'mean': mean,
+                'half_width': half_width,
+                'warmup_time': self.times[cutoff - 1] if cutoff > 0 else 0,
+                'observations': len(series) - cutoff
+            }
+            if not half_width <= self.relative_precision * abs(mean):
+                precise = False
+        return precise
+
+
+def run_until_precise(sim, kpis, relative_precision=0.05, **kwargs):
+    # runs a single long simulation until the chosen KPIs are precise or
+    # sim.simulation_end_time is reached
+    stopping = SequentialStopping(sim, kpis, relative_precision, **kwargs)
+    sim.simulate()
+    if not stopping.estimates:
+        stopping.evaluate()
+    return stopping
@@ -0,0 +1,100 @@
+import argparse
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from simulation import SURGERY_TIME_MODELS, HospitalSimulation
+
+
+def replication_seeds(base_seed, replications):
+    # SeedSequence.spawn gives statistically independent child streams,
+    # so no two replications share random numbers
+    children = np.random.SeedSequence(base_seed).spawn(replications)
+    return [int(child.generate_state(1, dtype=np.uint64)[0]) for child in children]
+
+
+def run_replication(simulation_end_time, seed, scenario=None, warmup_time=0, surgery_time_model='fitted',
+                    pregenerate_arrivals=False):
+    sim = HospitalSimulation(simulation_end_time=simulation_end_time, seed=seed, scenario=scenario,
+                             trace_level='off', warmup_time=warmup_time, surgery_time_model=surgery_time_model,
+                             pregenerate_arrivals=pregenerate_arrivals)
+    sim.simulate()
+    # only the KPI dict goes back to the parent process, not the trace table
+    return sim.compute_statistics()
+
+
+def summarize(results, confidence=0.95):
+    from scipy import stats
+
+    summary = {}
+    for kpi in results[0]:
+        values = [result[kpi] for result in results if result[kpi] is not None]
+        n = len(values)
+        if n == 0:
+            continue
+        mean = sum(values) / n
+        std = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1)) if n > 1 else 0.0
+        half_width = float(stats.t.ppf((1 + confidence) / 2, n - 1)) * std / math.sqrt(n) if n > 1 else float('nan')
+        summary[kpi] = {
+            'mean': mean,
+            'std': std,
+            'ci_lower': mean - half_width,
+            'ci_upper': mean + half_width,
+            'n': n
+        }
+    return summary
+
+
+def run_replications(replications=10, simulation_end_time=43200, seed=100, workers=None, confidence=0.95,
+                     scenario=None, warmup_time=0, surgery_time_model='fitted', pregenerate_arrivals=False):
+    seeds = replication_seeds(seed, replications)
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_replication, [simulation_end_time] * replications, seeds,
+                                    [scenario] * replications, [warmup_time] * replications,
+                                    [surgery_time_model] * replications, [pregenerate_arrivals] * replications))
+    return results, summarize(results, confidence)
+
+
+def compare_scenarios(scenario_a, scenario_b, replications=10, simulation_end_time=43200, seed=100,
+                      workers=None, confidence=0.95, **kwargs):
+    # both scenarios reuse the same replication seeds, so each pair shares
+    # its random streams and the CI is on the paired difference b - a
+    results_a, _ = run_replications(replications, simulation_end_time, seed, workers, confidence, scenario_a, **kwargs)
+    results_b, _ = run_replications(replications, simulation_end_time, seed, workers, confidence, scenario_b, **kwargs)
+    differences = []
+    for result_a, result_b in zip(results_a, results_b):
+        differences.append({
+            kpi: (result_b[kpi] - result_a[kpi]
+                  if result_a[kpi] is not None and result_b[kpi] is not None else None)
+            for kpi in result_a
+        })
+    return summarize(differences, confidence)
+
+
+def print_summary(summary, confidence=0.95):
+    print(f"{'KPI':<45}{'Mean':>12}{'Std':>12}{f'{confidence:.0%} CI':>28}")
+    for kpi, values in summary.items():
+        ci = f"[{values['ci_lower']:.4f}, {values['ci_upper']:.4f}]"
+        print(f"{kpi:<45}{values['mean']:>12.4f}{values['std']:>12.4f}{ci:>28}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run independent replications of the hospital simulation")
+    parser.add_argument('--replications', type=int, default=10)
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--warmup-days', type=float, default=0,
+                        help="statistics collected before this time are discarded")
+    parser.add_argument('--surgery-times', choices=SURGERY_TIME_MODELS, default='fitted')
+    parser.add_argument('--pregenerate', action='store_true')
+    args = parser.parse_args()
+
+    results, summary = run_replications(args.replications, args.days * 24 * 60, args.seed,
+                                        args.workers, args.confidence, warmup_time=args.warmup_days * 24 * 60,
+                                        surgery_time_model=args.surgery_times, pregenerate_arrivals=args.pregenerate)
+    print_summary(summary, args.confidence)
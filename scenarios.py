@@ -0,0 +1,108 @@
+import copy
+import itertools
+import json
+import numbers
+import os
+
+from classes import Emergency, PreSurgery, Labratory, OperatingRoom, ICU, CCU, Ward
+
+
+DEFAULT_SCENARIO = {
+    'capacities': {
+        'Emergency': Emergency.capacity,
+        'PreSurgery': PreSurgery.capacity,
+        'Laboratory': Labratory.capacity,
+        'OperatingRoom': OperatingRoom.capacity,
+        'ICU': ICU.capacity,
+        'CCU': CCU.capacity,
+        'Ward': Ward.capacity
+    },
+    # share of beds the backup generators keep running during an outage
+    'outage_coverage': {
+        'ICU': 0.8,
+        'CCU': 0.8
+    },
+    # mean minutes between arrivals
+    'elective_interarrival': 60,
+    'nonelective_interarrival': 15,
+    'group_probability': 0.02,
+    # busy emergency beds plus ambulances waiting before patients are turned
+    # away; None means the number of emergency beds, i.e. no ambulances wait
+    'emergency_load_limit': None
+}
+
+# surgery time distributions fitted by surgerytime_dist.py
+SURGERY_TIME_PARAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'surgery_time_params.json')
+
+# the rounded normal fits the model used before surgerytime_dist.py wrote
+# SURGERY_TIME_PARAMS; with rng_streams='shared' they reproduce its traces
+LEGACY_SURGERY_TIME_PARAMS = {
+    'simple': {'distribution': 'normal', 'params': {'mu': 30.22, 'sigma': 4.96}},
+    'moderate': {'distribution': 'normal', 'params': {'mu': 67.09, 'sigma': 8.96}},
+    'complex': {'distribution': 'normal', 'params': {'mu': 217.83, 'sigma': 56.95}}
+}
+
+
+def load_surgery_time_params(path=SURGERY_TIME_PARAMS):
+    # {surgery type: {'distribution': ..., 'params': {...}, ...}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def build_scenario(overrides=None):
+    scenario = copy.deepcopy(DEFAULT_SCENARIO)
+    for key, value in (overrides or {}).items():
+        if key not in scenario:
+            raise KeyError(f"Unknown scenario setting: {key}")
+        if isinstance(scenario[key], dict):
+            unknown = set(value) - set(scenario[key])
+            if unknown:
+                raise KeyError(f"Unknown {key} entries: {sorted(unknown)}")
+            scenario[key].update(value)
+        else:
+            scenario[key] = value
+    for name, capacity in scenario['capacities'].items():
+        if not isinstance(capacity, numbers.Integral) or isinstance(capacity, bool) or capacity < 0:
+            raise ValueError(f"capacities.{name} must be a non-negative integer, got {capacity!r}")
+    for name, coverage in scenario['outage_coverage'].items():
+        if not isinstance(coverage, numbers.Real) or not 0 <= coverage <= 1:
+            raise ValueError(f"outage_coverage.{name} must be between 0 and 1, got {coverage!r}")
+    return scenario
+
+
+def flatten_scenario(overrides):
+    # {'capacities': {'ICU': 18}} -> {'capacities.ICU': 18}
+    flat = {}
+    for key, value in overrides.items():
+        if isinstance(value, dict):
+            for inner_key, inner_value in value.items():
+                flat[f'{key}.{inner_key}'] = inner_value
+        else:
+            flat[key] = value
+    return flat
+
+
+def unflatten_scenario(flat):
+    overrides = {}
+    for key, value in flat.items():
+        if '.' in key:
+            outer, inner = key.split('.', 1)
+            overrides.setdefault(outer, {})[inner] = value
+        else:
+            overrides[key] = value
+    return overrides
+
+
+def expand_grid(grid):
+    # grid maps flattened setting names to lists of values
+    keys = list(grid)
+    return [unflatten_scenario(dict(zip(keys, values))) for values in itertools.product(*grid.values())]
+
+
+def load_scenarios(path):
+    # a JSON file holding either {"grid": {...}} or {"scenarios": [...]}
+    with open(path) as f:
+        config = json.load(f)
+    if 'grid' in config:
+        return expand_grid(config['grid'])
+    return config['scenarios']
@@ -1,22 +1,26 @@
 import random
 import math
-import pandas as pd
 import os
-from classes import *
+import pickle
+
+import numpy as np
 
-dist = Distributions()
+from classes import *
+from instrumentation import *
+from scenarios import SURGERY_TIME_PARAMS, build_scenario, load_surgery_time_params
+from trace_sinks import TRACE_LEVELS, AggregateTrace, ExcelTraceSink, MemoryTraceSink
 
-def TransferFromOperatingroom(stype):
+def TransferFromOperatingroom(stype, rng=random):
     if stype == "simple":
         d = "w"
     elif stype == "complex":
-        r = random.random()
+        r = rng.random()
         if r <= 0.75:
             d = 'i'
         else:
             d = 'c'
     else:
-        r = random.random()
+        r = rng.random()
         if r <= 0.70:
             d = 'w'
         elif 0.7 < r <= 0.8:
@@ -25,74 +29,203 @@ def TransferFromOperatingroom(stype):
             d = 'c'
     return d
     
-def death():
-    r = random.random()
+def death(rng=random):
+    r = rng.random()
     if r <= 0.1:
         return 'death'
     else:
         return 'transfer'
 
+EVENT_TYPES = (
+    'Elective Arrival',
+    'Non-Elective Arrival',
+    'Power Outage Start',
+    'Power Outage End',
+    'Paperwork Complete',
+    'Lab Complete',
+    'Ready for Surgery',
+    'Surgery End',
+    'Ward Discharge',
+    'ICU Discharge',
+    'CCU Discharge',
+    'End of Simulation',
+    'Warm-up End'
+)
+
+(ELECTIVE_ARRIVAL, NONELECTIVE_ARRIVAL, POWER_OUTAGE_START, POWER_OUTAGE_END, PAPERWORK_COMPLETE,
+ LAB_COMPLETE, READY_FOR_SURGERY, SURGERY_END, WARD_DISCHARGE, ICU_DISCHARGE, CCU_DISCHARGE,
+ END_OF_SIMULATION, WARMUP_END) = range(len(EVENT_TYPES))
+
+# 'fitted' samples each surgery type from its best parametric fit, 'empirical'
+# and 'kde' from the inverse CDF tables stored alongside it
+SURGERY_TIME_MODELS = ('fitted', 'empirical', 'kde')
+
+DEPARTMENT_ATTRIBUTES = {
+    'Emergency': 'emergency',
+    'PreSurgery': 'presurgery',
+    'Laboratory': 'laboratory',
+    'OperatingRoom': 'operating_room',
+    'ICU': 'icu',
+    'CCU': 'ccu',
+    'Ward': 'ward'
+}
+
 class HospitalSimulation:
-    def __init__(self, simulation_end_time=43200):
+    def __init__(self, simulation_end_time=43200, seed=100, capacities=None, trace_level='full', trace_sink=None,
+                 rng_backend='scalar', rng_streams='independent', scenario=None, warmup_time=0,
+                 checkpoint_interval=None, checkpoint_path=None, surgery_time_params=SURGERY_TIME_PARAMS,
+                 surgery_time_model='fitted', trace_bucket=60, trace_event_types=None, trace_patient_ids=None,
+                 pregenerate_arrivals=False):
+        if trace_level not in TRACE_LEVELS:
+            raise ValueError(f"trace_level must be one of {TRACE_LEVELS}, got {trace_level!r}")
+        if surgery_time_model not in SURGERY_TIME_MODELS:
+            raise ValueError(f"surgery_time_model must be one of {SURGERY_TIME_MODELS}, got {surgery_time_model!r}")
+        if checkpoint_interval and not checkpoint_path:
+            raise ValueError("checkpoint_interval needs a checkpoint_path")
+        if checkpoint_interval and isinstance(trace_sink, ExcelTraceSink):
+            raise ValueError("an Excel trace cannot be checkpointed; use a CSV or Parquet trace")
+        if (checkpoint_interval and trace_level != 'off'
+                and (trace_sink is None or isinstance(trace_sink, MemoryTraceSink))):
+            # every checkpoint would pickle all trace rows so far, making
+            # periodic checkpoints quadratic in the run length
+            raise ValueError("periodic checkpoints need the trace on disk; use a CSV or Parquet trace "
+                             "or trace_level='off'")
         self.clock = 0
         self.simulation_end_time = simulation_end_time
-        self.future_event_list = []
-        
-        Emergency.available_beds = 10
-        Emergency.queue = 0
-        PreSurgery.available_beds = 50
-        PreSurgery.queue = 0
-        Labratory.available_beds = 3
-        Labratory.queue = 0
-        OperatingRoom.available_beds = 50
-        OperatingRoom.queue = 0
-        CCU.available_beds = 20
-        CCU.queue = 0
-        ICU.available_beds = 15
-        ICU.queue = 0
-        Ward.available_beds = 100
-        Ward.queue = 0
-        Patient.id = 0
-        powerout.count = 0
+        self.warmup_time = warmup_time
+        self.stop_requested = False
+        self.initialized = False
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.next_checkpoint_time = checkpoint_interval if checkpoint_interval else math.inf
+        self.future_event_list = EventCalendar()
+        self.current_event = None
+        self.observers = {hook: [] for hook in OBSERVER_HOOKS}
+        self.profiler = None
+        self.event_names = []
+        self.event_codes = {}
+        self.base_event_handlers = []
+        self.event_handlers = []
+        for name, handler in zip(EVENT_TYPES, (
+                self.process_elective_arrival,
+                self.process_nonelective_arrival,
+                self.process_power_outage_start,
+                self.process_power_outage_end,
+                self.process_paperwork_complete,
+                self.process_lab_complete,
+                self.process_ready_for_surgery,
+                self.process_surgery_end,
+                self.process_ward_discharge,
+                self.process_icu_discharge,
+                self.process_ccu_discharge,
+                self.process_end_of_simulation,
+                self.process_warmup_end)):
+            self.register_event_type(name, handler)
+        if rng_streams not in ('independent', 'shared'):
+            raise ValueError(f"rng_streams must be 'independent' or 'shared', got {rng_streams!r}")
+        self.seed = seed
+        self.streams = RandomStreams(seed, rng_backend, independent=rng_streams == 'independent')
+        
+        scenario = dict(scenario or {})
+        if capacities:
+            scenario['capacities'] = {**scenario.get('capacities', {}), **capacities}
+        self.scenario = build_scenario(scenario)
+        capacities = self.scenario['capacities']
+        self.emergency = Emergency(capacities['Emergency'])
+        self.presurgery = PreSurgery(capacities['PreSurgery'])
+        self.laboratory = Labratory(capacities['Laboratory'])
+        self.operating_room = OperatingRoom(capacities['OperatingRoom'])
+        self.icu = ICU(capacities['ICU'])
+        self.ccu = CCU(capacities['CCU'])
+        self.ward = Ward(capacities['Ward'])
+        self.outage_coverage = self.scenario['outage_coverage']
+        self.elective_interarrival = self.scenario['elective_interarrival']
+        self.nonelective_interarrival = self.scenario['nonelective_interarrival']
+        self.group_probability = self.scenario['group_probability']
+        self.emergency_load_limit = self.scenario['emergency_load_limit']
+        if self.emergency_load_limit is None:
+            self.emergency_load_limit = capacities['Emergency']
+        elif self.emergency_load_limit < capacities['Emergency']:
+            raise ValueError(f"emergency_load_limit ({self.emergency_load_limit}) is below the "
+                             f"{capacities['Emergency']} emergency beds")
+        if isinstance(surgery_time_params, str):
+            surgery_time_params = load_surgery_time_params(surgery_time_params)
+        self.surgery_time_params = surgery_time_params
+        self.surgery_time_model = surgery_time_model
+        # sampler and keyword arguments per surgery type, e.g. normal_dist(mu=..., sigma=...)
+        self.surgery_time_samplers = {}
+        for surgery_type, fit in surgery_time_params.items():
+            if surgery_time_model == 'fitted':
+                sampler = (getattr(self.streams.surgery_time, fit['distribution'] + '_dist'), fit['params'])
+            else:
+                sampler = (self.streams.surgery_time.empirical_dist, {'quantiles': fit[surgery_time_model]['quantiles']})
+            self.surgery_time_samplers[surgery_type] = sampler
+        self.departments = {
+            'Emergency': self.emergency,
+            'PreSurgery': self.presurgery,
+            'Laboratory': self.laboratory,
+            'OperatingRoom': self.operating_room,
+            'ICU': self.icu,
+            'CCU': self.ccu,
+            'Ward': self.ward
+        }
+        self.next_patient_id = 0
         
         self.power_outages = []
+        self.pregenerate_arrivals = pregenerate_arrivals
+        self.timelines = None
         self.icu_reduced_capacity = False
         self.ccu_reduced_capacity = False
         
         self.queues = {
-            'Emergency': [],
-            'PreSurgery': [],
-            'Laboratory': [],
-            'OperatingRoom': [],
-            'ICU': [],
-            'CCU': [],
-            'Ward': []
+            'Emergency': DepartmentQueue(),
+            'PreSurgery': DepartmentQueue(),
+            'Laboratory': DepartmentQueue(),
+            'OperatingRoom': DepartmentQueue(),
+            'ICU': DepartmentQueue(),
+            'CCU': DepartmentQueue(),
+            'Ward': DepartmentQueue()
         }
         
         self.patients = {}
-        self.trace_table = []
+        self.trace_level = trace_level
+        self.trace_sink = trace_sink if trace_sink is not None else MemoryTraceSink()
+        self.trace_table = self.trace_sink.rows if isinstance(self.trace_sink, MemoryTraceSink) else []
+        if isinstance(self.trace_sink, ExcelTraceSink):
+            self.trace_sink.summary = self.compute_statistics
         self.step_counter = 0
         
+        # with either filter set, per-event rows are only recorded for the
+        # listed event types and patient ids
+        self.trace_event_types = set(trace_event_types or ())
+        self.trace_patient_ids = set(trace_patient_ids or ())
+        self.trace_filtered = bool(self.trace_event_types or self.trace_patient_ids)
+        
         self.patient_stats = {}
-        self.queue_stats = {dept: {'length': [], 'wait_time': []} for dept in self.queues.keys()}
-        self.bed_utilization = {
-            'Emergency': [],
-            'PreSurgery': [],
-            'Laboratory': [],
-            'OperatingRoom': [],
-            'ICU': [],
-            'CCU': [],
-            'Ward': []
-        }
+        self.reset_statistics()
+        self.last_clock = 0
+        self.trace_aggregate = AggregateTrace(self, trace_bucket) if trace_level == 'aggregate' else None
+    
+    def reset_statistics(self):
+        # drops everything collected so far, used to cut off the warm-up period
+        self.completed_patients = CompletedPatients()
+        self.queue_stats = {dept: {'length': TimeWeightedStat(), 'wait_count': 0, 'wait_sum': 0} for dept in self.queues.keys()}
+        self.bed_utilization = {dept: TimeWeightedStat() for dept in self.departments}
         self.emergency_full_count = 0
         self.emergency_check_count = 0
         self.resurgery_count = 0
         self.complex_surgery_count = 0
-        self.last_clock = 0
     
     def record_trace(self, event_type, patient_id):
         self.step_counter += 1
         
+        if self.trace_aggregate is not None:
+            self.trace_aggregate.record()
+            return
+        if (self.trace_filtered and event_type not in self.trace_event_types
+                and patient_id not in self.trace_patient_ids):
+            return
+        
         emergency_queue = len(self.queues['Emergency'])
         presurgery_queue = len(self.queues['PreSurgery'])
         lab_queue = len(self.queues['Laboratory'])
@@ -101,18 +234,13 @@ class HospitalSimulation:
         ccu_queue = len(self.queues['CCU'])
         ward_queue = len(self.queues['Ward'])
         
-        emergency_busy = 10 - Emergency.available_beds
-        presurgery_busy = 50 - PreSurgery.available_beds
-        lab_busy = 3 - Labratory.available_beds
-        or_busy = 50 - OperatingRoom.available_beds
-        icu_busy = 15 - ICU.available_beds
-        ccu_busy = 20 - CCU.available_beds
-        ward_busy = 100 - Ward.available_beds
-        
-        emergency_wait = sum(self.clock - p['enter_time'] for p in self.queues['Emergency'])
-        lab_wait = sum(self.clock - p['enter_time'] for p in self.queues['Laboratory'])
-        or_wait = sum(self.clock - p['enter_time'] for p in self.queues['OperatingRoom'])
-        icu_wait = sum(self.clock - p['enter_time'] for p in self.queues['ICU'])
+        emergency_busy = self.emergency.busy_beds
+        presurgery_busy = self.presurgery.busy_beds
+        lab_busy = self.laboratory.busy_beds
+        or_busy = self.operating_room.busy_beds
+        icu_busy = self.icu.busy_beds
+        ccu_busy = self.ccu.busy_beds
+        ward_busy = self.ward.busy_beds
         
         trace_entry = {
             'Step': self.step_counter,
@@ -132,122 +260,253 @@ class HospitalSimulation:
             'OR Busy': or_busy,
             'ICU Busy': icu_busy,
             'CCU Busy': ccu_busy,
-            'Ward Busy': ward_busy,
-            'Emergency Wait Time': round(emergency_wait, 2),
-            'Lab Wait Time': round(lab_wait, 2),
-            'OR Wait Time': round(or_wait, 2),
-            'ICU Wait Time': round(icu_wait, 2),
-            'FEL Size': len(self.future_event_list),
-            'Next Event Time': round(self.future_event_list[0]['Event Time'], 2) if self.future_event_list else '',
-            'Next Event Type': self.future_event_list[0]['Event Type'] if self.future_event_list else ''
+            'Ward Busy': ward_busy
         }
         
-        self.trace_table.append(trace_entry)
+        if self.trace_level == 'full':
+            trace_entry['Emergency Wait Time'] = round(self.queues['Emergency'].total_wait(self.clock), 2)
+            trace_entry['PreSurgery Wait Time'] = round(self.queues['PreSurgery'].total_wait(self.clock), 2)
+            trace_entry['Lab Wait Time'] = round(self.queues['Laboratory'].total_wait(self.clock), 2)
+            trace_entry['OR Wait Time'] = round(self.queues['OperatingRoom'].total_wait(self.clock), 2)
+            trace_entry['ICU Wait Time'] = round(self.queues['ICU'].total_wait(self.clock), 2)
+            trace_entry['CCU Wait Time'] = round(self.queues['CCU'].total_wait(self.clock), 2)
+            trace_entry['Ward Wait Time'] = round(self.queues['Ward'].total_wait(self.clock), 2)
+            trace_entry['FEL Size'] = len(self.future_event_list)
+            trace_entry['Next Event Time'] = round(self.future_event_list[0].time, 2) if self.future_event_list else ''
+            trace_entry['Next Event Type'] = self.event_names[self.future_event_list[0].code] if self.future_event_list else ''
+        
+        self.trace_sink.write(trace_entry)
+    
+    def register_event_type(self, name, handler):
+        # handlers are called with the event's patient id; the full event is
+        # available as self.current_event while the handler runs
+        code = self.event_codes.get(name)
+        if code is None:
+            code = len(self.event_names)
+            self.event_names.append(name)
+            self.base_event_handlers.append(handler)
+            self.event_handlers.append(None)
+            self.event_codes[name] = code
+        else:
+            self.base_event_handlers[code] = handler
+        self.event_handlers[code] = self.dispatch_entry(code)
+        return code
+    
+    def dispatch_entry(self, code):
+        handler = self.base_event_handlers[code]
+        if self.observers['event']:
+            handler = ObservedHandler(self, handler)
+        if self.profiler is not None:
+            handler = TimedEvent(self.profiler, self, self.event_names[code], handler)
+        return handler
+    
+    def add_observer(self, hook, callback):
+        if hook not in self.observers:
+            raise ValueError(f"hook must be one of {OBSERVER_HOOKS}, got {hook!r}")
+        self.observers[hook].append(callback)
+        self.instrument()
+    
+    def remove_observer(self, hook, callback):
+        self.observers[hook].remove(callback)
+        self.instrument()
+    
+    def enable_profiler(self, profiler=None):
+        self.profiler = profiler or Profiler()
+        self.instrument()
+        return self.profiler
+    
+    def disable_profiler(self):
+        self.profiler = None
+        self.instrument()
+    
+    def instrument(self):
+        # Observers and the profiler are installed by wrapping the dispatch
+        # table, instance methods and departments, and removed the same way,
+        # so the main loop pays nothing for them when none are active.
+        for name in PROFILED_METHODS:
+            self.__dict__.pop(name, None)
+        self.event_handlers[:] = [self.dispatch_entry(code) for code in range(len(self.base_event_handlers))]
+        
+        if self.observers['queue_entry']:
+            self.add_to_queue = ObservedQueueEntry(self, self.add_to_queue)
+        if self.observers['queue_exit']:
+            self.remove_from_queue = ObservedQueueExit(self, self.remove_from_queue)
+        if self.profiler is not None:
+            for name in PROFILED_METHODS:
+                stats = self.profiler.handlers.setdefault(name, CallStats())
+                setattr(self, name, TimedMethod(stats, getattr(self, name)))
+        
+        observe_beds = bool(self.observers['bed_seize'] or self.observers['bed_release'])
+        for name, department in list(self.departments.items()):
+            if observe_beds and not isinstance(department, ObservedDepartment):
+                department = ObservedDepartment(self, name, department)
+            elif not observe_beds and isinstance(department, ObservedDepartment):
+                department = department.restore()
+            self.departments[name] = department
+            setattr(self, DEPARTMENT_ATTRIBUTES[name], department)
     
     def schedule_event(self, event_type, event_time, patient_id=None, extra_data=None):
-        event = {
-            'Event Type': event_type,
-            'Event Time': event_time,
-            'Patient ID': patient_id,
-            'Extra Data': extra_data or {}
-        }
-        self.future_event_list.append(event)
-        self.future_event_list.sort(key=lambda x: x['Event Time'])
+        if isinstance(event_type, str):
+            event_type = self.event_codes[event_type]
+        self.future_event_list.push(Event(event_time, event_type, patient_id, extra_data))
     
     def update_statistics(self):
         time_delta = self.clock - self.last_clock
         
-        self.bed_utilization['Emergency'].append((time_delta, max(0, 10 - Emergency.available_beds)))
-        self.bed_utilization['PreSurgery'].append((time_delta, max(0, 50 - PreSurgery.available_beds)))
-        self.bed_utilization['Laboratory'].append((time_delta, max(0, 3 - Labratory.available_beds)))
-        self.bed_utilization['OperatingRoom'].append((time_delta, max(0, 50 - OperatingRoom.available_beds)))
-        self.bed_utilization['ICU'].append((time_delta, max(0, 15 - ICU.available_beds)))
-        self.bed_utilization['CCU'].append((time_delta, max(0, 20 - CCU.available_beds)))
-        self.bed_utilization['Ward'].append((time_delta, max(0, 100 - Ward.available_beds)))
+        self.bed_utilization['Emergency'].update(time_delta, max(0, self.emergency.busy_beds))
+        self.bed_utilization['PreSurgery'].update(time_delta, max(0, self.presurgery.busy_beds))
+        self.bed_utilization['Laboratory'].update(time_delta, max(0, self.laboratory.busy_beds))
+        self.bed_utilization['OperatingRoom'].update(time_delta, max(0, self.operating_room.busy_beds))
+        self.bed_utilization['ICU'].update(time_delta, max(0, self.icu.busy_beds))
+        self.bed_utilization['CCU'].update(time_delta, max(0, self.ccu.busy_beds))
+        self.bed_utilization['Ward'].update(time_delta, max(0, self.ward.busy_beds))
         
         for dept_name, queue in self.queues.items():
-            self.queue_stats[dept_name]['length'].append((time_delta, len(queue)))
+            self.queue_stats[dept_name]['length'].update(time_delta, len(queue))
         
         self.last_clock = self.clock
     
+    def snapshot_statistics(self, new_window=True):
+        snapshot = {'Clock': self.clock}
+        for dept in self.departments:
+            queue_length = self.queue_stats[dept]['length']
+            beds_used = self.bed_utilization[dept]
+            snapshot[f'{dept} Avg Queue Length'] = queue_length.window_mean()
+            snapshot[f'{dept} Max Queue Length'] = queue_length.window_max
+            snapshot[f'{dept} Avg Busy Beds'] = beds_used.window_mean()
+            snapshot[f'{dept} Max Busy Beds'] = beds_used.window_max
+            if new_window:
+                queue_length.start_window()
+                beds_used.start_window()
+        return snapshot
+    
     def add_to_queue(self, department, patient_id, priority=False):
         self.queues[department].append({
             'patient_id': patient_id,
             'enter_time': self.clock,
             'priority': priority
         })
-        self.queues[department].sort(key=lambda x: (not x['priority'], x['enter_time']))
     
     def remove_from_queue(self, department):
         if len(self.queues[department]) > 0:
-            patient_entry = self.queues[department].pop(0)
+            patient_entry = self.queues[department].popleft()
             wait_time = self.clock - patient_entry['enter_time']
-            self.queue_stats[department]['wait_time'].append(wait_time)
+            stats = self.queue_stats[department]
+            stats['wait_count'] += 1
+            stats['wait_sum'] += wait_time
             return patient_entry['patient_id'], wait_time
         return None, 0
     
+    def create_patient(self, patient_class):
+        patient = patient_class(self.next_patient_id)
+        self.next_patient_id += 1
+        return patient
+    
     def initialize(self):
-        for month in range(int(self.simulation_end_time / (30 * 24 * 60)) + 1):
-            powerout_event = powerout()
-            start_time, finish_time = powerout.time()
-            if start_time < self.simulation_end_time:
-                self.schedule_event('Power Outage Start', start_time, None)
-                self.schedule_event('Power Outage End', finish_time, None)
-                self.power_outages.append((start_time, finish_time))
+        if self.pregenerate_arrivals:
+            self.timelines = self.build_timelines()
+            self.power_outages = list(zip(self.timelines['outage'].times, self.timelines['outage'].values))
+            for name, code in (('outage', POWER_OUTAGE_START), ('elective', ELECTIVE_ARRIVAL),
+                               ('nonelective', NONELECTIVE_ARRIVAL)):
+                self.schedule_next(name, code)
+        else:
+            for month in range(int(self.simulation_end_time / (30 * 24 * 60)) + 1):
+                outage = powerout(month + 1, self.streams.power_outage)
+                start_time, finish_time = outage.time()
+                if start_time < self.simulation_end_time:
+                    self.schedule_event(POWER_OUTAGE_START, start_time, None)
+                    self.schedule_event(POWER_OUTAGE_END, finish_time, None)
+                    self.power_outages.append((start_time, finish_time))
+            
+            first_elective_time = self.streams.elective_arrival.exponential_dist(self.elective_interarrival)
+            self.schedule_event(ELECTIVE_ARRIVAL, first_elective_time, None)
+            
+            first_nonelective_time = self.streams.nonelective_arrival.exponential_dist(self.nonelective_interarrival)
+            self.schedule_event(NONELECTIVE_ARRIVAL, first_nonelective_time, None)
+        
+        self.schedule_event(END_OF_SIMULATION, self.simulation_end_time, None)
+        
+        if 0 < self.warmup_time < self.simulation_end_time:
+            self.schedule_event(WARMUP_END, self.warmup_time, None)
+    
+    def build_timelines(self):
+        # The whole arrival process and the outage windows for the horizon,
+        # generated in one numpy pass per stream. The calendar only ever
+        # holds the next event of each timeline (see schedule_next). The
+        # timelines have their own numpy generators whatever rng_backend and
+        # rng_streams are, so they never match the default mode's draws.
+        end_time = self.simulation_end_time
+        generators = {name: np.random.default_rng(stream_seed(self.seed, name + ' timeline'))
+                      for name in ('elective_arrival', 'nonelective_arrival', 'group_arrival', 'power_outage')}
         
-        first_elective_time = dist.exponential_dist(60)
-        self.schedule_event('Elective Arrival', first_elective_time, None)
+        elective = arrival_times(generators['elective_arrival'], self.elective_interarrival, end_time)
+        nonelective = arrival_times(generators['nonelective_arrival'], self.nonelective_interarrival, end_time)
+        # group size per non-elective arrival, 0 for a single patient
+        is_group = generators['group_arrival'].random(len(nonelective)) < self.group_probability
+        group_sizes = np.where(is_group, generators['group_arrival'].integers(2, 6, len(nonelective)), 0)
         
-        first_nonelective_time = dist.exponential_dist(15)
-        self.schedule_event('Non-Elective Arrival', first_nonelective_time, None)
+        # one day-long outage on a uniform day of every 30-day month, as powerout() draws them
+        months = np.arange(1, int(end_time / (30 * 24 * 60)) + 2)
+        days = generators['power_outage'].integers(1, 31, len(months))
+        outage_start = (months * 30 + (days - 1)) * 24 * 60
+        outage_start = outage_start[outage_start < end_time]
         
-        self.schedule_event('End of Simulation', self.simulation_end_time, None)
+        return {
+            'elective': Timeline(elective),
+            'nonelective': Timeline(nonelective, group_sizes),
+            'outage': Timeline(outage_start.astype(float), outage_start + 24 * 60.0)
+        }
+    
+    def schedule_next(self, timeline, event_type):
+        # the timeline's value travels with the event as extra_data
+        entry = self.timelines[timeline].next()
+        if entry is not None:
+            self.schedule_event(event_type, entry[0], None, entry[1])
     
     def assign_patient_times(self, patient):
-        patient.in_lab_time = dist.uniform_dist(28, 32)
+        patient.in_lab_time = self.streams.lab_time.uniform_dist(28, 32)
         
         if patient.paperwork_time == 60:
             patient.before_surgery_time = 2 * 24 * 60
         else:
-            patient.before_surgery_time = dist.triangular_dist(5, 75, 100)
+            patient.before_surgery_time = self.streams.before_surgery_time.triangular_dist(5, 75, 100)
         
-        possibility = random.random()
+        possibility = self.streams.surgery_type.random()
         if possibility <= 0.50:
-            patient.surgery_time = dist.normal_dist(30.22, 4.96)
             patient.surgery_type = "simple"
         elif possibility <= 0.95:
-            patient.surgery_time = dist.normal_dist(67.09, 8.96)
             patient.surgery_type = "moderate"
         else:
-            patient.surgery_time = dist.normal_dist(217.83, 56.95)
             patient.surgery_type = "complex"
+        sample, params = self.surgery_time_samplers[patient.surgery_type]
+        patient.surgery_time = sample(**params)
         
         if patient.surgery_type == 'complex':
-            if death() == 'death':
+            if death(self.streams.death) == 'death':
                 patient.service = 'end'
                 patient.bedriddentime = None
                 patient.transfer_location = None
             else:
-                location = TransferFromOperatingroom(patient.surgery_type)
+                location = TransferFromOperatingroom(patient.surgery_type, self.streams.routing)
                 patient.transfer_location = location
                 if location == 'w':
-                    patient.bedriddentime = dist.exponential_dist(50*60)
+                    patient.bedriddentime = self.streams.bedridden_time.exponential_dist(50*60)
                 elif location == 'i':
-                    patient.bedriddentime = dist.exponential_dist(25*60)
+                    patient.bedriddentime = self.streams.bedridden_time.exponential_dist(25*60)
                 else:
-                    patient.bedriddentime = dist.exponential_dist(25*60)
+                    patient.bedriddentime = self.streams.bedridden_time.exponential_dist(25*60)
         else:
-            location = TransferFromOperatingroom(patient.surgery_type)
+            location = TransferFromOperatingroom(patient.surgery_type, self.streams.routing)
             patient.transfer_location = location
             if location == 'w':
-                patient.bedriddentime = dist.exponential_dist(50*60)
+                patient.bedriddentime = self.streams.bedridden_time.exponential_dist(50*60)
             elif location == 'i':
-                patient.bedriddentime = dist.exponential_dist(25*60)
+                patient.bedriddentime = self.streams.bedridden_time.exponential_dist(25*60)
             else:
-                patient.bedriddentime = dist.exponential_dist(25*60)
+                patient.bedriddentime = self.streams.bedridden_time.exponential_dist(25*60)
     
     def process_elective_arrival(self, patient_id):
-        patient = Elective()
+        patient = self.create_patient(Elective)
         self.patients[patient.id] = patient
         self.assign_patient_times(patient)
         
@@ -260,25 +519,32 @@ class HospitalSimulation:
             'current_location': None
         }
         
-        next_arrival_time = self.clock + dist.exponential_dist(60)
-        self.schedule_event('Elective Arrival', next_arrival_time, None)
+        if self.timelines is None:
+            next_arrival_time = self.clock + self.streams.elective_arrival.exponential_dist(self.elective_interarrival)
+            self.schedule_event(ELECTIVE_ARRIVAL, next_arrival_time, None)
+        else:
+            self.schedule_next('elective', ELECTIVE_ARRIVAL)
         
-        if PreSurgery.available_beds > 0:
-            PreSurgery.available_beds -= 1
+        if self.presurgery.available_beds > 0:
+            self.presurgery.available_beds -= 1
             self.patient_stats[patient.id]['current_location'] = 'PreSurgery'
-            self.schedule_event('Paperwork Complete', self.clock + patient.paperwork_time, patient.id)
+            self.schedule_event(PAPERWORK_COMPLETE, self.clock + patient.paperwork_time, patient.id)
         else:
             self.add_to_queue('PreSurgery', patient.id, priority=False)
     
     def process_nonelective_arrival(self, patient_id):
-        is_group = random.random() < 0.02
+        if self.timelines is None:
+            group_size = None
+            is_group = self.streams.group_arrival.random() < self.group_probability
+        else:
+            group_size = self.current_event.extra_data
+            is_group = group_size > 0
         if is_group:
-            group = GroupEnterance()
-            group.group_arrival_time = self.clock
+            group = GroupEnterance(self.streams.group_arrival, self.create_patient, self.clock, group_size)
             for patient in group.patients:
                 self.emergency_check_count += 1
-                total_emergency_load = (10 - Emergency.available_beds) + len(self.queues['Emergency'])
-                if total_emergency_load >= 10:
+                total_emergency_load = (self.emergency.busy_beds) + len(self.queues['Emergency'])
+                if total_emergency_load >= self.emergency_load_limit:
                     self.emergency_full_count += 1
                     continue
                 self.patients[patient.id] = patient
@@ -293,19 +559,19 @@ class HospitalSimulation:
                     'current_location': None
                 }
                 
-                if Emergency.available_beds > 0:
-                    Emergency.available_beds -= 1
+                if self.emergency.available_beds > 0:
+                    self.emergency.available_beds -= 1
                     self.patient_stats[patient.id]['current_location'] = 'Emergency'
-                    self.schedule_event('Paperwork Complete', self.clock + patient.paperwork_time, patient.id)
+                    self.schedule_event(PAPERWORK_COMPLETE, self.clock + patient.paperwork_time, patient.id)
                 else:
                     self.add_to_queue('Emergency', patient.id, priority=True)
         else:
             self.emergency_check_count += 1
-            total_emergency_load = (10 - Emergency.available_beds) + len(self.queues['Emergency'])
-            if total_emergency_load >= 10:
+            total_emergency_load = (self.emergency.busy_beds) + len(self.queues['Emergency'])
+            if total_emergency_load >= self.emergency_load_limit:
                 self.emergency_full_count += 1
             else:
-                patient = NoneElective()
+                patient = self.create_patient(NoneElective)
                 self.patients[patient.id] = patient
                 self.assign_patient_times(patient)
                 
@@ -318,61 +584,64 @@ class HospitalSimulation:
                     'current_location': None
                 }
                 
-                if Emergency.available_beds > 0:
-                    Emergency.available_beds -= 1
+                if self.emergency.available_beds > 0:
+                    self.emergency.available_beds -= 1
                     self.patient_stats[patient.id]['current_location'] = 'Emergency'
-                    self.schedule_event('Paperwork Complete', self.clock + patient.paperwork_time, patient.id)
+                    self.schedule_event(PAPERWORK_COMPLETE, self.clock + patient.paperwork_time, patient.id)
                 else:
                     self.add_to_queue('Emergency', patient.id, priority=True)
         
-        next_arrival_time = self.clock + dist.exponential_dist(15)
-        self.schedule_event('Non-Elective Arrival', next_arrival_time, None)
+        if self.timelines is None:
+            next_arrival_time = self.clock + self.streams.nonelective_arrival.exponential_dist(self.nonelective_interarrival)
+            self.schedule_event(NONELECTIVE_ARRIVAL, next_arrival_time, None)
+        else:
+            self.schedule_next('nonelective', NONELECTIVE_ARRIVAL)
     
     def process_paperwork_complete(self, patient_id):
         patient = self.patients[patient_id]
         
-        if Labratory.available_beds > 0:
-            Labratory.available_beds -= 1
-            self.schedule_event('Lab Complete', self.clock + patient.in_lab_time, patient_id)
+        if self.laboratory.available_beds > 0:
+            self.laboratory.available_beds -= 1
+            self.schedule_event(LAB_COMPLETE, self.clock + patient.in_lab_time, patient_id)
         else:
             self.add_to_queue('Laboratory', patient_id)
     
     def process_lab_complete(self, patient_id):
         patient = self.patients[patient_id]
         
-        Labratory.available_beds += 1
+        self.laboratory.available_beds += 1
         
         next_patient, _ = self.remove_from_queue('Laboratory')
         if next_patient:
-            Labratory.available_beds -= 1
+            self.laboratory.available_beds -= 1
             next_patient_obj = self.patients[next_patient]
-            self.schedule_event('Lab Complete', self.clock + next_patient_obj.in_lab_time, next_patient)
+            self.schedule_event(LAB_COMPLETE, self.clock + next_patient_obj.in_lab_time, next_patient)
         
-        self.schedule_event('Ready for Surgery', self.clock + patient.before_surgery_time, patient_id)
+        self.schedule_event(READY_FOR_SURGERY, self.clock + patient.before_surgery_time, patient_id)
     
     def process_ready_for_surgery(self, patient_id):
         current_location = self.patient_stats[patient_id]['current_location']
         
-        if OperatingRoom.available_beds > 0:
-            OperatingRoom.available_beds -= 1
+        if self.operating_room.available_beds > 0:
+            self.operating_room.available_beds -= 1
             
             if current_location == 'Emergency':
-                Emergency.available_beds += 1
+                self.emergency.available_beds += 1
                 next_patient, _ = self.remove_from_queue('Emergency')
                 if next_patient:
-                    Emergency.available_beds -= 1
+                    self.emergency.available_beds -= 1
                     self.patient_stats[next_patient]['current_location'] = 'Emergency'
                     next_patient_obj = self.patients[next_patient]
-                    self.schedule_event('Paperwork Complete', self.clock + next_patient_obj.paperwork_time, next_patient)
+                    self.schedule_event(PAPERWORK_COMPLETE, self.clock + next_patient_obj.paperwork_time, next_patient)
                     
             elif current_location == 'PreSurgery':
-                PreSurgery.available_beds += 1
+                self.presurgery.available_beds += 1
                 next_patient, _ = self.remove_from_queue('PreSurgery')
                 if next_patient:
-                    PreSurgery.available_beds -= 1
+                    self.presurgery.available_beds -= 1
                     self.patient_stats[next_patient]['current_location'] = 'PreSurgery'
                     next_patient_obj = self.patients[next_patient]
-                    self.schedule_event('Paperwork Complete', self.clock + next_patient_obj.paperwork_time, next_patient)
+                    self.schedule_event(PAPERWORK_COMPLETE, self.clock + next_patient_obj.paperwork_time, next_patient)
             
             self.patient_stats[patient_id]['current_location'] = 'OperatingRoom'
             self.start_surgery(patient_id)
@@ -385,11 +654,11 @@ class HospitalSimulation:
         if patient.surgery_type == 'complex':
             self.complex_surgery_count += 1
         
-        self.schedule_event('Surgery End', self.clock + patient.surgery_time + 10, patient_id)
+        self.schedule_event(SURGERY_END, self.clock + patient.surgery_time + 10, patient_id)
     
     def check_resurgery_needed(self, patient):
         if patient.surgery_type == "complex":
-            r = random.random()
+            r = self.streams.resurgery.random()
             if r <= 0.01:
                 return True
         return False
@@ -398,290 +667,389 @@ class HospitalSimulation:
         patient = self.patients[patient_id]
         
         if hasattr(patient, 'service') and patient.service == 'end':
-            OperatingRoom.available_beds += 1
+            self.operating_room.available_beds += 1
             self.check_or_queue()
             
-            self.patient_stats[patient_id]['departure_time'] = self.clock
-            self.patient_stats[patient_id]['current_location'] = 'Died'
+            self.release_patient(patient_id, 'Died')
             return
         
         if self.check_resurgery_needed(patient):
             self.resurgery_count += 1
-            OperatingRoom.available_beds += 1
+            self.operating_room.available_beds += 1
             self.check_or_queue()
             
             self.patient_stats[patient_id]['current_location'] = 'OperatingRoom'
             
-            if OperatingRoom.available_beds > 0:
-                OperatingRoom.available_beds -= 1
+            if self.operating_room.available_beds > 0:
+                self.operating_room.available_beds -= 1
                 self.start_surgery(patient_id)
             else:
                 self.add_to_queue('OperatingRoom', patient_id)
             return
         
-        OperatingRoom.available_beds += 1
+        self.operating_room.available_beds += 1
         self.check_or_queue()
         
         location = patient.transfer_location
         
         if location == 'w':
-            if Ward.available_beds > 0:
-                Ward.available_beds -= 1
+            if self.ward.available_beds > 0:
+                self.ward.available_beds -= 1
                 self.patient_stats[patient_id]['current_location'] = 'Ward'
-                self.schedule_event('Ward Discharge', self.clock + patient.bedriddentime, patient_id)
+                self.schedule_event(WARD_DISCHARGE, self.clock + patient.bedriddentime, patient_id)
             else:
                 self.add_to_queue('Ward', patient_id)
                 self.patient_stats[patient_id]['current_location'] = 'Waiting for Ward'
                 
         elif location == 'i':
-            if ICU.available_beds > 0:
-                ICU.available_beds -= 1
+            if self.icu.available_beds > 0:
+                self.icu.available_beds -= 1
                 self.patient_stats[patient_id]['current_location'] = 'ICU'
-                self.schedule_event('ICU Discharge', self.clock + patient.bedriddentime, patient_id)
+                self.schedule_event(ICU_DISCHARGE, self.clock + patient.bedriddentime, patient_id)
             else:
                 self.add_to_queue('ICU', patient_id)
                 self.patient_stats[patient_id]['current_location'] = 'Waiting for ICU'
                 
         else:
-            if CCU.available_beds > 0:
-                CCU.available_beds -= 1
+            if self.ccu.available_beds > 0:
+                self.ccu.available_beds -= 1
                 self.patient_stats[patient_id]['current_location'] = 'CCU'
-                self.schedule_event('CCU Discharge', self.clock + patient.bedriddentime, patient_id)
+                self.schedule_event(CCU_DISCHARGE, self.clock + patient.bedriddentime, patient_id)
             else:
                 self.add_to_queue('CCU', patient_id)
                 self.patient_stats[patient_id]['current_location'] = 'Waiting for CCU'
     
+    def release_patient(self, patient_id, outcome):
+        # the patient has left the system, so its record moves to the
+        # completed store and it is dropped from the live dictionaries
+        stats = self.patient_stats.pop(patient_id)
+        stats['departure_time'] = self.clock
+        stats['current_location'] = outcome
+        self.completed_patients.append(patient_id, stats, outcome)
+        del self.patients[patient_id]
+    
+    def process_ward_discharge(self, patient_id):
+        self.process_discharge(patient_id, 'Ward')
+    
+    def process_icu_discharge(self, patient_id):
+        self.process_discharge(patient_id, 'ICU')
+    
+    def process_ccu_discharge(self, patient_id):
+        self.process_discharge(patient_id, 'CCU')
+    
+    def process_end_of_simulation(self, patient_id=None):
+        pass
+    
+    def process_warmup_end(self, patient_id=None):
+        self.reset_statistics()
+    
     def process_discharge(self, patient_id, department):
-        patient = self.patients[patient_id]
-        
         if department == 'Ward':
-            Ward.available_beds += 1
+            self.ward.available_beds += 1
             next_patient, _ = self.remove_from_queue('Ward')
             if next_patient:
-                Ward.available_beds -= 1
+                self.ward.available_beds -= 1
                 self.patient_stats[next_patient]['current_location'] = 'Ward'
                 next_patient_obj = self.patients[next_patient]
-                self.schedule_event('Ward Discharge', self.clock + next_patient_obj.bedriddentime, next_patient)
-            self.patient_stats[patient_id]['departure_time'] = self.clock
-            self.patient_stats[patient_id]['current_location'] = 'Discharged'
+                self.schedule_event(WARD_DISCHARGE, self.clock + next_patient_obj.bedriddentime, next_patient)
+            self.release_patient(patient_id, 'Discharged')
         
         elif department == 'ICU':
-            ICU.available_beds += 1
+            self.icu.available_beds += 1
             if self.icu_reduced_capacity:
-                max_available = int(15 * 0.8)
-                if ICU.available_beds > max_available:
-                    ICU.available_beds = max_available
+                max_available = int(self.icu.capacity * self.outage_coverage['ICU'])
+                if self.icu.available_beds > max_available:
+                    self.icu.available_beds = max_available
             next_patient, _ = self.remove_from_queue('ICU')
             if next_patient:
-                ICU.available_beds -= 1
+                self.icu.available_beds -= 1
                 self.patient_stats[next_patient]['current_location'] = 'ICU'
                 next_patient_obj = self.patients[next_patient]
-                self.schedule_event('ICU Discharge', self.clock + next_patient_obj.bedriddentime, next_patient)
-            if Ward.available_beds > 0 and self.queues['Ward']:
-                Ward.available_beds -= 1
+                self.schedule_event(ICU_DISCHARGE, self.clock + next_patient_obj.bedriddentime, next_patient)
+            if self.ward.available_beds > 0 and self.queues['Ward']:
+                self.ward.available_beds -= 1
                 ward_patient_id, _ = self.remove_from_queue('Ward')
                 self.patient_stats[ward_patient_id]['current_location'] = 'Ward'
                 ward_patient = self.patients[ward_patient_id]
-                self.schedule_event('Ward Discharge', self.clock + ward_patient.bedriddentime, ward_patient_id)
-            self.patient_stats[patient_id]['departure_time'] = self.clock
-            self.patient_stats[patient_id]['current_location'] = 'Discharged'
+                self.schedule_event(WARD_DISCHARGE, self.clock + ward_patient.bedriddentime, ward_patient_id)
+            self.release_patient(patient_id, 'Discharged')
         
         elif department == 'CCU':
-            CCU.available_beds += 1
+            self.ccu.available_beds += 1
             if self.ccu_reduced_capacity:
-                max_available = int(20 * 0.8)
-                if CCU.available_beds > max_available:
-                    CCU.available_beds = max_available
+                max_available = int(self.ccu.capacity * self.outage_coverage['CCU'])
+                if self.ccu.available_beds > max_available:
+                    self.ccu.available_beds = max_available
             next_patient, _ = self.remove_from_queue('CCU')
             if next_patient:
-                CCU.available_beds -= 1
+                self.ccu.available_beds -= 1
                 self.patient_stats[next_patient]['current_location'] = 'CCU'
                 next_patient_obj = self.patients[next_patient]
-                self.schedule_event('CCU Discharge', self.clock + next_patient_obj.bedriddentime, next_patient)
-            if Ward.available_beds > 0 and self.queues['Ward']:
-                Ward.available_beds -= 1
+                self.schedule_event(CCU_DISCHARGE, self.clock + next_patient_obj.bedriddentime, next_patient)
+            if self.ward.available_beds > 0 and self.queues['Ward']:
+                self.ward.available_beds -= 1
                 ward_patient_id, _ = self.remove_from_queue('Ward')
                 self.patient_stats[ward_patient_id]['current_location'] = 'Ward'
                 ward_patient = self.patients[ward_patient_id]
-                self.schedule_event('Ward Discharge', self.clock + ward_patient.bedriddentime, ward_patient_id)
-            self.patient_stats[patient_id]['departure_time'] = self.clock
-            self.patient_stats[patient_id]['current_location'] = 'Discharged'
+                self.schedule_event(WARD_DISCHARGE, self.clock + ward_patient.bedriddentime, ward_patient_id)
+            self.release_patient(patient_id, 'Discharged')
     
     def check_or_queue(self):
         next_patient, _ = self.remove_from_queue('OperatingRoom')
         if next_patient:
             next_location = self.patient_stats[next_patient]['current_location']
-            OperatingRoom.available_beds -= 1
+            self.operating_room.available_beds -= 1
             if next_location == 'Emergency':
-                Emergency.available_beds += 1
+                self.emergency.available_beds += 1
                 waiting_patient, _ = self.remove_from_queue('Emergency')
                 if waiting_patient:
-                    Emergency.available_beds -= 1
+                    self.emergency.available_beds -= 1
                     self.patient_stats[waiting_patient]['current_location'] = 'Emergency'
                     waiting_patient_obj = self.patients[waiting_patient]
-                    self.schedule_event('Paperwork Complete', self.clock + waiting_patient_obj.paperwork_time, waiting_patient)
+                    self.schedule_event(PAPERWORK_COMPLETE, self.clock + waiting_patient_obj.paperwork_time, waiting_patient)
             elif next_location == 'PreSurgery':
-                PreSurgery.available_beds += 1
+                self.presurgery.available_beds += 1
                 waiting_patient, _ = self.remove_from_queue('PreSurgery')
                 if waiting_patient:
-                    PreSurgery.available_beds -= 1
+                    self.presurgery.available_beds -= 1
                     self.patient_stats[waiting_patient]['current_location'] = 'PreSurgery'
                     waiting_patient_obj = self.patients[waiting_patient]
-                    self.schedule_event('Paperwork Complete', self.clock + waiting_patient_obj.paperwork_time, waiting_patient)
+                    self.schedule_event(PAPERWORK_COMPLETE, self.clock + waiting_patient_obj.paperwork_time, waiting_patient)
             self.patient_stats[next_patient]['current_location'] = 'OperatingRoom'
             self.start_surgery(next_patient)
     
-    def process_power_outage_start(self):
+    def process_power_outage_start(self, patient_id=None):
         self.icu_reduced_capacity = True
         self.ccu_reduced_capacity = True
+        if self.timelines is not None:
+            # extra_data holds the end of this outage window
+            self.schedule_event(POWER_OUTAGE_END, self.current_event.extra_data, None)
         
-        icu_max = int(15 * 0.8)
-        ccu_max = int(20 * 0.8)
+        icu_max = int(self.icu.capacity * self.outage_coverage['ICU'])
+        ccu_max = int(self.ccu.capacity * self.outage_coverage['CCU'])
         
-        if ICU.available_beds > icu_max:
-            ICU.available_beds = icu_max
-        if CCU.available_beds > ccu_max:
-            CCU.available_beds = ccu_max
+        if self.icu.available_beds > icu_max:
+            self.icu.available_beds = icu_max
+        if self.ccu.available_beds > ccu_max:
+            self.ccu.available_beds = ccu_max
     
-    def process_power_outage_end(self):
+    def process_power_outage_end(self, patient_id=None):
         self.icu_reduced_capacity = False
         self.ccu_reduced_capacity = False
+        if self.timelines is not None:
+            self.schedule_next('outage', POWER_OUTAGE_START)
+    
+    def stop(self):
+        # cooperative cancellation: the current event finishes, then
+        # simulate(), step(), run_until() or snapshots() returns; safe to
+        # call from a handler, an observer, a progress callback or a thread
+        self.stop_requested = True
     
     def run(self):
-        self.initialize()
+        # returns the trace as a DataFrame, like create_trace_excel(); a
+        # trace_sink that streams to disk keeps no rows, so it is empty then
+        self.simulate()
+        self.print_statistics()
+        if self.trace_table:
+            return self.create_trace_excel()
+        import pandas as pd
+
+        return pd.DataFrame(self.trace_table)
+    
+    def checkpoint(self, path=None):
+        # written to a temporary file first so a crash mid-write never
+        # leaves a broken checkpoint behind
+        path = path or self.checkpoint_path
+        if not path:
+            raise ValueError("checkpoint() needs a path when the simulation has no checkpoint_path")
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+    
+    @classmethod
+    def resume(cls, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    
+    @property
+    def finished(self):
+        return self.initialized and (self.clock >= self.simulation_end_time or not self.future_event_list)
+    
+    def advance(self, until=math.inf, max_events=math.inf):
+        # Processes events in time order while they fall before `until`, at
+        # most max_events of them, and returns how many were handled. The
+        # clock stays at the last event, so a run advanced in slices gives
+        # the same results as one uninterrupted run.
+        if not self.initialized:
+            self.initialize()
+            self.initialized = True
+        if until >= self.simulation_end_time:
+            until = math.inf
         
-        while self.future_event_list and self.clock < self.simulation_end_time:
-            current_event = self.future_event_list.pop(0)
+        event_handlers = self.event_handlers
+        future_event_list = self.future_event_list
+        processed = 0
+        while (future_event_list and self.clock < self.simulation_end_time and not self.stop_requested
+               and processed < max_events and future_event_list[0].time < until):
+            current_event = future_event_list.pop()
             
             self.update_statistics()
             
-            self.clock = current_event['Event Time']
+            self.clock = current_event.time
             
             if self.clock >= self.simulation_end_time:
                 break
             
-            event_type = current_event['Event Type']
-            patient_id = current_event['Patient ID']
-            extra_data = current_event.get('Extra Data', {})
+            self.current_event = current_event
+            patient_id = current_event.patient_id
             
-            self.record_trace(event_type, patient_id)
+            if self.trace_level != 'off':
+                self.record_trace(self.event_names[current_event.code], patient_id)
             
-            if event_type == 'Elective Arrival':
-                self.process_elective_arrival(patient_id)
+            event_handlers[current_event.code](patient_id)
+            processed += 1
             
-            elif event_type == 'Non-Elective Arrival':
-                self.process_nonelective_arrival(patient_id)
-            
-            elif event_type == 'Power Outage Start':
-                self.process_power_outage_start()
-            
-            elif event_type == 'Power Outage End':
-                self.process_power_outage_end()
-            
-            elif event_type == 'Paperwork Complete':
-                self.process_paperwork_complete(patient_id)
-            
-            elif event_type == 'Lab Complete':
-                self.process_lab_complete(patient_id)
-            
-            elif event_type == 'Ready for Surgery':
-                self.process_ready_for_surgery(patient_id)
+            if self.clock >= self.next_checkpoint_time:
+                while self.next_checkpoint_time <= self.clock:
+                    self.next_checkpoint_time += self.checkpoint_interval
+                self.checkpoint()
+        return processed
+    
+    def step(self, n=1):
+        self.stop_requested = False
+        return self.advance(max_events=n)
+    
+    def run_until(self, time):
+        # handles every event before `time`
+        self.stop_requested = False
+        return self.advance(until=time)
+    
+    def state(self):
+        # cheap view of the current state; compute_statistics() gives the
+        # KPIs so far at any point of the run
+        state = {'Clock': self.clock, 'Events': self.future_event_list.popped_count}
+        for name, department in self.departments.items():
+            state[f'{name} Queue'] = len(self.queues[name])
+            state[f'{name} Busy'] = department.busy_beds
+        return state
+    
+    def snapshots(self, stride, until=None):
+        # advances the run `stride` minutes of simulated time at a time and
+        # yields the state at each boundary ('Time'), until the run ends, is
+        # stopped or reaches `until`; finish() closes the trace once it is over
+        end_time = self.simulation_end_time if until is None else min(until, self.simulation_end_time)
+        self.stop_requested = False
+        boundary = self.clock - self.clock % stride
+        while boundary < end_time and not self.finished and not self.stop_requested:
+            boundary = min(boundary + stride, end_time)
+            self.advance(until=boundary)
+            yield {'Time': boundary, **self.state()}
+    
+    def finish(self):
+        # closes the trace once the run is over; a run that was stopped or
+        # only advanced part way keeps its trace open so it can be continued
+        if self.finished:
+            self.close()
+    
+    def close(self):
+        # ends the trace at the current clock, also for a run that will not
+        # be continued; an Excel trace cannot be written to afterwards
+        if self.trace_aggregate is not None:
+            self.trace_aggregate.finish(min(self.clock, self.simulation_end_time))
+        self.trace_sink.close()
+    
+    def simulate(self, progress=None, progress_stride=24 * 60):
+        # progress, e.g. a ProgressReporter, is called with the simulation
+        # every progress_stride minutes of simulated time
+        if progress is None:
+            self.stop_requested = False
+            self.advance()
+        else:
+            progress(self)
+            for _ in self.snapshots(progress_stride):
+                progress(self)
+        self.finish()
+    
+    def compute_statistics(self):
+        statistics = {}
+        
+        total_time = self.completed_patients.total_time_in_system()
+        completed_patients = len(self.completed_patients)
+        
+        statistics['Average Time in System'] = total_time / completed_patients if completed_patients > 0 else None
+        statistics['Probability of Emergency Full'] = (self.emergency_full_count / self.emergency_check_count
+                                                       if self.emergency_check_count > 0 else None)
+        
+        departments = ['PreSurgery', 'Laboratory', 'OperatingRoom', 'ICU', 'CCU', 'Ward']
+        for dept in departments:
+            queue_length = self.queue_stats[dept]['length']
+            max_queue = queue_length.max
+            avg_queue_length = queue_length.mean()
             
-            elif event_type == 'Surgery End':
-                self.process_surgery_end(patient_id)
+            wait_count = self.queue_stats[dept]['wait_count']
+            avg_wait_time = self.queue_stats[dept]['wait_sum'] / wait_count if wait_count else 0
             
-            elif 'Discharge' in event_type:
-                dept = event_type.split()[0]
-                self.process_discharge(patient_id, dept)
+            statistics[f'{dept} Max Queue Length'] = max_queue
+            statistics[f'{dept} Avg Queue Length'] = avg_queue_length
+            statistics[f'{dept} Avg Wait Time'] = avg_wait_time
         
-        self.print_statistics()
-        return self.create_trace_excel()
+        statistics['Complex Surgeries'] = self.complex_surgery_count
+        statistics['Re-surgeries'] = self.resurgery_count
+        statistics['Avg Re-surgeries per Complex Surgery'] = (self.resurgery_count / self.complex_surgery_count
+                                                              if self.complex_surgery_count > 0 else None)
+        
+        for dept, department in self.departments.items():
+            # undefined for a department without beds
+            avg_utilization = (self.bed_utilization[dept].mean() / department.capacity * 100
+                               if department.capacity > 0 else None)
+            statistics[f'{dept} Utilization'] = avg_utilization
+        
+        return statistics
     
     def print_statistics(self):
+        statistics = self.compute_statistics()
         print("SIMULATION STATISTICS")
         
-        total_time = 0
-        completed_patients = 0
-        for pid, data in self.patient_stats.items():
-            if data['departure_time']:
-                total_time += data['departure_time'] - data['system_entry_time']
-                completed_patients += 1
-        
-        if completed_patients > 0:
-            avg_time_in_system = total_time / completed_patients
+        avg_time_in_system = statistics['Average Time in System']
+        if avg_time_in_system is not None:
             print(f"\n1. Average Time in System: {avg_time_in_system:.2f} minutes ({avg_time_in_system/60:.2f} hours)")
         
-        if self.emergency_check_count > 0:
-            prob_emergency_full = self.emergency_full_count / self.emergency_check_count
+        prob_emergency_full = statistics['Probability of Emergency Full']
+        if prob_emergency_full is not None:
             print(f"\n2. Probability of Emergency Full: {prob_emergency_full:.4f} ({prob_emergency_full*100:.2f}%)")
         
         print(f"\n3. Queue Statistics by Department:")
         
         departments = ['PreSurgery', 'Laboratory', 'OperatingRoom', 'ICU', 'CCU', 'Ward']
         for dept in departments:
-            max_queue = 0
-            total_weighted_length = 0
-            total_time = 0
-            
-            for time_delta, length in self.queue_stats[dept]['length']:
-                max_queue = max(max_queue, length)
-                total_weighted_length += time_delta * length
-                total_time += time_delta
-            
-            avg_queue_length = total_weighted_length / total_time if total_time > 0 else 0
-            
-            wait_times = self.queue_stats[dept]['wait_time']
-            avg_wait_time = sum(wait_times) / len(wait_times) if wait_times else 0
-            
             print(f"  {dept}:")
-            print(f"    - Max Queue Length: {max_queue}")
-            print(f"    - Avg Queue Length: {avg_queue_length:.2f}")
-            print(f"    - Avg Wait Time: {avg_wait_time:.2f} minutes")
+            print(f"    - Max Queue Length: {statistics[f'{dept} Max Queue Length']}")
+            print(f"    - Avg Queue Length: {statistics[f'{dept} Avg Queue Length']:.2f}")
+            print(f"    - Avg Wait Time: {statistics[f'{dept} Avg Wait Time']:.2f} minutes")
         
-        if self.complex_surgery_count > 0:
-            avg_resurgery = self.resurgery_count / self.complex_surgery_count
+        avg_resurgery = statistics['Avg Re-surgeries per Complex Surgery']
+        if avg_resurgery is not None:
             print(f"\n4. Re-surgery Statistics:")
-            print(f"   - Complex Surgeries: {self.complex_surgery_count}")
-            print(f"   - Re-surgeries: {self.resurgery_count}")
+            print(f"   - Complex Surgeries: {statistics['Complex Surgeries']}")
+            print(f"   - Re-surgeries: {statistics['Re-surgeries']}")
             print(f"   - Avg Re-surgeries per Complex Surgery: {avg_resurgery:.4f}")
         
         print(f"\n5. Bed Utilization by Department:")
         
-        bed_capacity = {
-            'Emergency': 10,
-            'PreSurgery': 50,
-            'Laboratory': 3,
-            'OperatingRoom': 50,
-            'ICU': 15,
-            'CCU': 20,
-            'Ward': 100
-        }
-        
-        for dept, capacity in bed_capacity.items():
-            total_weighted_usage = 0
-            total_time = 0
-            
-            for time_delta, beds_used in self.bed_utilization[dept]:
-                total_weighted_usage += time_delta * beds_used
-                total_time += time_delta
-            
-            avg_utilization = (total_weighted_usage / total_time / capacity * 100) if total_time > 0 else 0
-            
-            print(f"  {dept}: {avg_utilization:.2f}%")
+        for dept in self.departments:
+            if statistics[f'{dept} Utilization'] is not None:
+                print(f"  {dept}: {statistics[f'{dept} Utilization']:.2f}%")
     
-    def create_trace_excel(self):
-        df = pd.DataFrame(self.trace_table)
-        
-        excel_file = os.path.join(os.getcwd(), 'hospital_simulation_trace.xlsx')
-        
-        with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Trace Table', index=False)
-            
-            worksheet = writer.sheets['Trace Table']
-            for idx, column in enumerate(df.columns):
-                column_length = max(df[column].astype(str).map(len).max(), len(column))
-                col_letter = chr(65 + idx) if idx < 26 else chr(65 + idx//26 - 1) + chr(65 + idx%26)
-                worksheet.column_dimensions[col_letter].width = min(column_length + 2, 50)
-        
-        return df
+    def create_trace_excel(self, excel_file=None):
+        # exports an in-memory trace; pass an .xlsx trace_sink instead to
+        # stream the trace to Excel during the run
+        excel_file = excel_file or os.path.join(os.getcwd(), 'hospital_simulation_trace.xlsx')
+        sink = ExcelTraceSink(excel_file)
+        sink.summary = self.compute_statistics
+        for row in self.trace_table:
+            sink.write(row)
+        sink.close()
+        import pandas as pd
 
+        return pd.DataFrame(self.trace_table)
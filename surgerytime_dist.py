@@ -1,136 +1,251 @@
-import pandas as pd
+import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import stats
-import seaborn as sns
 
-# Set style for better-looking plots
-sns.set_style("whitegrid")
-plt.rcParams['figure.figsize'] = (15, 10)
+from scenarios import SURGERY_TIME_PARAMS
 
-def analyze_surgery_data(file_path):
+# pandas, scipy, matplotlib and seaborn are imported where they are used, so
+# the module starts fast and the statistics never touch a plotting backend
 
-    # Read data
-    df = pd.read_excel(file_path, sheet_name='Sheet1')
+# Candidate families with their scipy distribution and a fit returning the
+# parameters under the names used by the simulator's *_dist samplers. The
+# positive families are fitted with the location fixed at 0.
+CANDIDATE_DISTRIBUTIONS = ('normal', 'lognormal', 'gamma', 'weibull')
+
+
+def fit_distribution(distribution, data):
+    from scipy import stats
     
-    # Get unique surgery types
-    surgery_types = df['Surgery Type'].unique()
+    if distribution == 'normal':
+        params = {'mu': np.mean(data), 'sigma': np.std(data, ddof=1)}
+        frozen = stats.norm(params['mu'], params['sigma'])
+    elif distribution == 'lognormal':
+        sigma, _, scale = stats.lognorm.fit(data, floc=0)
+        params = {'mu': np.log(scale), 'sigma': sigma}
+        frozen = stats.lognorm(sigma, scale=scale)
+    elif distribution == 'gamma':
+        shape, _, scale = stats.gamma.fit(data, floc=0)
+        params = {'shape': shape, 'scale': scale}
+        frozen = stats.gamma(shape, scale=scale)
+    elif distribution == 'weibull':
+        shape, _, scale = stats.weibull_min.fit(data, floc=0)
+        params = {'shape': shape, 'scale': scale}
+        frozen = stats.weibull_min(shape, scale=scale)
+    else:
+        raise ValueError(f"Unknown distribution: {distribution}")
+    return {name: float(value) for name, value in params.items()}, frozen
+
+
+def empirical_quantiles(sorted_data, table_size=1001):
+    # inverse of the piecewise-linear empirical CDF, sampled at table_size
+    # equally spaced probabilities
+    return np.quantile(sorted_data, np.linspace(0, 1, table_size))
+
+
+def kde_quantiles(sorted_data, table_size=1001, bandwidth=None, grid_size=2048):
+    # inverse CDF of a Gaussian kernel density estimate (Silverman's rule of
+    # thumb bandwidth by default), clipped at 0 since durations are positive
+    from scipy.special import ndtr
     
-    # Create a figure for all analyses
-    fig = plt.figure(figsize=(20, 12))
+    n = len(sorted_data)
+    if bandwidth is None:
+        bandwidth = 1.06 * np.std(sorted_data, ddof=1) * n ** (-1 / 5)
+    grid = np.linspace(sorted_data[0] - 4 * bandwidth, sorted_data[-1] + 4 * bandwidth, grid_size)
+    cdf = ndtr((grid[:, None] - sorted_data[None, :]) / bandwidth).mean(axis=1)
+    quantiles = np.interp(np.linspace(0, 1, table_size), cdf, grid)
+    return np.maximum(quantiles, 0), float(bandwidth)
+
+
+def goodness_of_fit(sorted_data, bin_edges, hist, cdfs):
+    # cdfs holds one row per candidate; chi-square over the histogram bins
+    # and the KS statistic are computed for all candidates at once
+    from scipy import stats
     
-    results = {}
+    n = len(sorted_data)
+    expected = n * np.diff(cdfs(bin_edges), axis=1)
+    positive = expected > 0
+    components = np.divide((hist - expected) ** 2, expected, out=np.zeros_like(expected), where=positive)
+    chi_square = components.sum(axis=1)
+    # every candidate estimates 2 parameters, so df = k - 1 - 2
+    df_chi = positive.sum(axis=1) - 3
+    p_value = stats.chi2.sf(chi_square, np.maximum(df_chi, 1))
     
-    for idx, surgery_type in enumerate(surgery_types, 1):
-        # Filter data for this surgery type
-        data = df[df['Surgery Type'] == surgery_type]['Value (min)'].values
-        
-        # Sort data
-        sorted_data = np.sort(data)
-        n = len(data)
-        
-        # Calculate statistics
-        mean = np.mean(data)
-        std = np.std(data, ddof=1)
-        minimum = np.min(data)
-        maximum = np.max(data)
-        
-        # Calculate normal distribution parameters
-        # f(j-0.5)/n for normal probability
-        j = np.arange(1, n + 1)
-        cumulative_prob = (j - 0.5) / n
-        
-        # Calculate z-scores (inverse normal)
-        norm_scores = stats.norm.ppf(cumulative_prob)
-        
-        # Create bins for histogram
-        num_bins = int(np.sqrt(n)) + 1
-        hist, bin_edges = np.histogram(data, bins=num_bins)
-        bin_width = bin_edges[1] - bin_edges[0]
-        
-        # Calculate Oi (observed frequency), Ei (expected frequency)
-        intervals = []
-        for i in range(len(bin_edges) - 1):
-            lower = bin_edges[i]
-            upper = bin_edges[i + 1]
-            
-            # Observed frequency
-            oi = hist[i]
-            
-            # Expected frequency (using normal distribution)
-            prob_lower = stats.norm.cdf(lower, mean, std)
-            prob_upper = stats.norm.cdf(upper, mean, std)
-            ei = n * (prob_upper - prob_lower)
-            
-            intervals.append({
-                'bin_lower': lower,
-                'bin_upper': upper,
-                'bin_width': bin_width,
-                'Oi': oi,
-                'Ei': ei,
-                'Oi_Ei_sq': (oi - ei) ** 2,
-                'chi_sq_component': (oi - ei) ** 2 / ei if ei > 0 else 0
-            })
-        
-        # Calculate chi-square statistic
-        chi_square = sum([item['chi_sq_component'] for item in intervals if item['Ei'] > 0])
-        
-        # Degrees of freedom (k - 1 - number of parameters estimated)
-        # We estimated 2 parameters (mean and std), so df = k - 3
-        df_chi = len([item for item in intervals if item['Ei'] > 0]) - 3
-        
-        # Store results
-        results[surgery_type] = {
-            'data': data,
-            'sorted_data': sorted_data,
-            'mean': mean,
-            'std': std,
-            'min': minimum,
-            'max': maximum,
-            'n': n,
-            'cumulative_prob': cumulative_prob,
-            'norm_scores': norm_scores,
-            'intervals': intervals,
-            'chi_square': chi_square,
-            'df': df_chi,
-            'bin_edges': bin_edges,
-            'hist': hist
+    fitted = cdfs(sorted_data)
+    j = np.arange(1, n + 1)
+    ks_statistic = np.maximum((j / n - fitted).max(axis=1), (fitted - (j - 1) / n).max(axis=1))
+    return expected, components, chi_square, df_chi, p_value, ks_statistic
+
+
+def fit_surgery_times(data):
+    from scipy import stats
+    
+    sorted_data = np.sort(data)
+    n = len(data)
+    
+    # Calculate statistics
+    mean = np.mean(data)
+    std = np.std(data, ddof=1)
+    
+    # f(j-0.5)/n for normal probability
+    j = np.arange(1, n + 1)
+    cumulative_prob = (j - 0.5) / n
+    norm_scores = stats.norm.ppf(cumulative_prob)
+    
+    # Create bins for histogram
+    num_bins = int(np.sqrt(n)) + 1
+    hist, bin_edges = np.histogram(data, bins=num_bins)
+    bin_width = bin_edges[1] - bin_edges[0]
+    
+    candidates = [fit_distribution(distribution, data) for distribution in CANDIDATE_DISTRIBUTIONS]
+    expected, components, chi_square, df_chi, p_value, ks_statistic = goodness_of_fit(
+        sorted_data, bin_edges, hist, lambda x: np.array([frozen.cdf(x) for _, frozen in candidates]))
+    
+    fits = {
+        distribution: {
+            'params': params,
+            'chi_square': float(chi_square[i]),
+            'df': int(df_chi[i]),
+            'p_value': float(p_value[i]),
+            'ks_statistic': float(ks_statistic[i])
         }
-        
-        # Create subplots for each surgery type
-        # Histogram
-        ax1 = plt.subplot(len(surgery_types), 3, (idx-1)*3 + 1)
-        ax1.bar(bin_edges[:-1], hist, width=bin_width, alpha=0.7, edgecolor='black')
-        ax1.set_xlabel('Value (min)')
-        ax1.set_ylabel('Frequency')
-        ax1.set_title(f'{surgery_type} - Histogram')
-        ax1.grid(True, alpha=0.3)
-        
-        # Add normal curve overlay
-        x_range = np.linspace(minimum, maximum, 100)
-        normal_curve = n * bin_width * stats.norm.pdf(x_range, mean, std)
-        ax1.plot(x_range, normal_curve, 'r-', linewidth=2, label='Normal Distribution')
-        ax1.legend()
-        
-        # Q-Q Plot
-        ax2 = plt.subplot(len(surgery_types), 3, (idx-1)*3 + 2)
-        ax2.scatter(sorted_data, norm_scores, alpha=0.6)
-        
-        # Add reference line
-        z = np.polyfit(sorted_data, norm_scores, 1)
-        p = np.poly1d(z)
-        ax2.plot(sorted_data, p(sorted_data), "r--", linewidth=2)
-        
-        ax2.set_xlabel('Sample Values')
-        ax2.set_ylabel('Theoretical Quantiles')
-        ax2.set_title(f'{surgery_type} - Q-Q Plot')
-        ax2.grid(True, alpha=0.3)
-        
-        # Statistics text
-        ax3 = plt.subplot(len(surgery_types), 3, (idx-1)*3 + 3)
-        ax3.axis('off')
-        
-        stats_text = f"""
+        for i, (distribution, (params, _)) in enumerate(zip(CANDIDATE_DISTRIBUTIONS, candidates))
+    }
+    # the best fit has the largest chi-square p-value, ties broken by KS
+    best = max(CANDIDATE_DISTRIBUTIONS, key=lambda d: (fits[d]['p_value'], -fits[d]['ks_statistic']))
+    
+    # the interval table keeps reporting the normal fit
+    normal = CANDIDATE_DISTRIBUTIONS.index('normal')
+    intervals = [
+        {
+            'bin_lower': bin_edges[i],
+            'bin_upper': bin_edges[i + 1],
+            'bin_width': bin_width,
+            'Oi': hist[i],
+            'Ei': expected[normal, i],
+            'Oi_Ei_sq': (hist[i] - expected[normal, i]) ** 2,
+            'chi_sq_component': components[normal, i]
+        }
+        for i in range(len(hist))
+    ]
+    
+    kde, bandwidth = kde_quantiles(sorted_data)
+    
+    return {
+        'data': data,
+        'sorted_data': sorted_data,
+        'mean': mean,
+        'std': std,
+        'min': np.min(data),
+        'max': np.max(data),
+        'n': n,
+        'cumulative_prob': cumulative_prob,
+        'norm_scores': norm_scores,
+        'intervals': intervals,
+        'chi_square': fits['normal']['chi_square'],
+        'df': fits['normal']['df'],
+        'bin_edges': bin_edges,
+        'hist': hist,
+        'fits': fits,
+        'best': best,
+        'empirical': empirical_quantiles(sorted_data),
+        'kde': kde,
+        'kde_bandwidth': bandwidth
+    }
+
+
+def write_surgery_time_params(results, path=SURGERY_TIME_PARAMS):
+    # keyed by the simulator's surgery type names ("Simple Surgery" -> "simple");
+    # besides the best parametric fit, each entry carries inverse CDF tables
+    # for the empirical and KDE-smoothed alternatives
+    params = {}
+    for surgery_type, result in results.items():
+        fit = result['fits'][result['best']]
+        params[surgery_type.split()[0].lower()] = {
+            'distribution': result['best'],
+            'params': fit['params'],
+            'source': surgery_type,
+            'n': int(result['n']),
+            'chi_square': fit['chi_square'],
+            'p_value': fit['p_value'],
+            'ks_statistic': fit['ks_statistic'],
+            'empirical': {'quantiles': np.round(result['empirical'], 4).tolist()},
+            'kde': {'quantiles': np.round(result['kde'], 4).tolist(), 'bandwidth': result['kde_bandwidth']}
+        }
+    # one line per quantile table instead of one line per value
+    text = re.sub(r'\[\s+([^\[\]{}]*?)\s+\]', lambda match: '[' + ' '.join(match.group(1).split()) + ']',
+                  json.dumps(params, indent=2))
+    with open(path, 'w') as f:
+        f.write(text)
+    return params
+
+
+def plot_surgery_type(surgery_type, result, path, dpi=300):
+    # renders one surgery type's histogram, Q-Q plot and statistics on the
+    # non-interactive Agg backend; runs in a worker process
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from scipy import stats
+    
+    # Set style for better-looking plots
+    sns.set_style("whitegrid")
+    
+    sorted_data = result['sorted_data']
+    n = result['n']
+    mean = result['mean']
+    std = result['std']
+    minimum = result['min']
+    maximum = result['max']
+    norm_scores = result['norm_scores']
+    hist = result['hist']
+    bin_edges = result['bin_edges']
+    bin_width = bin_edges[1] - bin_edges[0]
+    chi_square = result['chi_square']
+    df_chi = result['df']
+    best = result['best']
+    
+    fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(20, 4))
+    
+    # Histogram
+    ax1.bar(bin_edges[:-1], hist, width=bin_width, alpha=0.7, edgecolor='black')
+    ax1.set_xlabel('Value (min)')
+    ax1.set_ylabel('Frequency')
+    ax1.set_title(f'{surgery_type} - Histogram')
+    ax1.grid(True, alpha=0.3)
+    
+    # Add normal curve overlay
+    x_range = np.linspace(minimum, maximum, 100)
+    normal_curve = n * bin_width * stats.norm.pdf(x_range, mean, std)
+    ax1.plot(x_range, normal_curve, 'r-', linewidth=2, label='Normal Distribution')
+    if best != 'normal':
+        _, frozen = fit_distribution(best, result['data'])
+        ax1.plot(x_range, n * bin_width * frozen.pdf(x_range), 'g--', linewidth=2,
+                 label=f'{best.capitalize()} (best fit)')
+    ax1.legend()
+    
+    # Q-Q Plot
+    ax2.scatter(sorted_data, norm_scores, alpha=0.6)
+    
+    # Add reference line
+    z = np.polyfit(sorted_data, norm_scores, 1)
+    p = np.poly1d(z)
+    ax2.plot(sorted_data, p(sorted_data), "r--", linewidth=2)
+    
+    ax2.set_xlabel('Sample Values')
+    ax2.set_ylabel('Theoretical Quantiles')
+    ax2.set_title(f'{surgery_type} - Q-Q Plot')
+    ax2.grid(True, alpha=0.3)
+    
+    # Statistics text
+    ax3.axis('off')
+    
+    stats_text = f"""
 {surgery_type} Statistics:
 
 Mean: {mean:.2f}
@@ -141,20 +256,106 @@ N: {n}
 
 Chi-Square: {chi_square:.2f}
 Degrees of Freedom: {df_chi}
-        """
+
+Best Fit: {best} (p = {result['fits'][best]['p_value']:.3f})
+    """
+    
+    ax3.text(0.1, 0.5, stats_text, fontsize=10, family='monospace',
+            verticalalignment='center')
+    
+    fig.tight_layout()
+    fig.savefig(path, dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    return path
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def surgery_cache_path(file_path):
+    root, _ = os.path.splitext(file_path)
+    return root + '.cache.npz'
+
+
+def read_surgery_cache(cache_path, source, mtime_ns):
+    # returns the cached samples, or None if the cache is missing or stale;
+    # an unchanged mtime is trusted, otherwise the content hash decides
+    if not os.path.exists(cache_path):
+        return None
+    with np.load(cache_path, allow_pickle=False) as cache:
+        if str(cache['source']) != source:
+            return None
+        if int(cache['mtime_ns']) != mtime_ns and str(cache['sha256']) != file_sha256(source):
+            return None
+        return {str(surgery_type): cache[f'values_{i}'] for i, surgery_type in enumerate(cache['surgery_types'])}
+
+
+def write_surgery_cache(cache_path, source, mtime_ns, samples):
+    arrays = {f'values_{i}': values for i, values in enumerate(samples.values())}
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, source=source, mtime_ns=mtime_ns, sha256=file_sha256(source),
+                 surgery_types=np.array(list(samples)), **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+def load_surgery_samples(file_path, cache=True):
+    # {surgery type: durations} in order of first appearance in the sheet.
+    # The parsed workbook is cached next to it as <name>.cache.npz, grouped
+    # by surgery type, and rebuilt when the workbook changes.
+    source = os.path.abspath(file_path)
+    mtime_ns = os.stat(source).st_mtime_ns
+    cache_path = surgery_cache_path(source)
+    if cache:
+        samples = read_surgery_cache(cache_path, source, mtime_ns)
+        if samples is not None:
+            return samples
+    
+    import pandas as pd
+    
+    df = pd.read_excel(file_path, sheet_name='Sheet1')
+    samples = {surgery_type: values['Value (min)'].to_numpy(dtype=float)
+               for surgery_type, values in df.groupby('Surgery Type', sort=False)}
+    if cache:
+        write_surgery_cache(cache_path, source, mtime_ns, samples)
+    return samples
+
+
+def analyze_surgery_data(file_path, params_path=None, workers=None, plot_dir=None, dpi=300, cache=True):
+    # Fits every surgery type and, when params_path is given, writes the
+    # best fits there; the command line writes SURGERY_TIME_PARAMS. Plots
+    # are only made when plot_dir is given, one PNG per surgery type,
+    # rendered in parallel.
+
+    # Read data, already grouped by surgery type
+    samples = load_surgery_samples(file_path, cache)
+    surgery_types = list(samples)
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Fit every surgery type in parallel
+        results = dict(zip(surgery_types, executor.map(fit_surgery_times, samples.values())))
         
-        ax3.text(0.1, 0.5, stats_text, fontsize=10, family='monospace',
-                verticalalignment='center')
+        if plot_dir is not None:
+            os.makedirs(plot_dir, exist_ok=True)
+            paths = [os.path.join(plot_dir, f'{surgery_type.replace(" ", "_")}_analysis.png')
+                     for surgery_type in surgery_types]
+            list(executor.map(plot_surgery_type, surgery_types, results.values(), paths,
+                              [dpi] * len(paths)))
     
-    plt.tight_layout()
-    plt.savefig('surgery_analysis.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    if params_path is not None:
+        write_surgery_time_params(results, params_path)
     
     return results
 
 
 def create_detailed_tables(results):
     """Create detailed tables similar to Excel output"""
+    import pandas as pd
     
     for surgery_type, data in results.items():
         print(f"\n{'='*80}")
@@ -187,20 +388,52 @@ def create_detailed_tables(results):
         print(f"\nChi-Square Statistic: {data['chi_square']:.4f}")
         print(f"Degrees of Freedom: {data['df']}")
         
+        # Candidate distributions
+        df_fits = pd.DataFrame({
+            distribution: {'params': fit['params'], 'chi_square': fit['chi_square'], 'df': fit['df'],
+                           'p_value': fit['p_value'], 'ks_statistic': fit['ks_statistic']}
+            for distribution, fit in data['fits'].items()
+        }).T
+        print(f"\n--- Candidate Distributions (best: {data['best']}) ---")
+        print(df_fits)
+        
         # Export to Excel
         with pd.ExcelWriter(f'{surgery_type.replace(" ", "_")}_analysis.xlsx') as writer:
             df_sorted.to_excel(writer, sheet_name='Sorted_Data', index=False)
             df_chi.to_excel(writer, sheet_name='Chi_Square', index=False)
+            df_fits.assign(params=df_fits['params'].astype(str)).to_excel(writer, sheet_name='Fits')
 
 
 if __name__ == "__main__":
-    
-    file_path = 'surgery_data.xlsx'
+    parser = argparse.ArgumentParser(description="Fit surgery time distributions to the surgery data")
+    parser.add_argument('file_path', nargs='?', default='surgery_data.xlsx')
+    parser.add_argument('--params', default=SURGERY_TIME_PARAMS,
+                        help="where to write the fitted parameters loaded by the simulator")
+    parser.add_argument('--plot', nargs='?', const='.', default=None, metavar='DIR',
+                        help="also save one PNG per surgery type (default directory: current)")
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--summary', action='store_true',
+                        help="print only the best fit per surgery type, without the detailed tables")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always parse the workbook instead of using or writing <name>.cache.npz")
+    args = parser.parse_args()
     
     # Run analysis
-    results = analyze_surgery_data(file_path)
+    results = analyze_surgery_data(args.file_path, args.params, args.workers, args.plot, args.dpi,
+                                   not args.no_cache)
     
-    # Create detailed tables
-    create_detailed_tables(results)
+    if args.summary:
+        for surgery_type, result in results.items():
+            fit = result['fits'][result['best']]
+            params = ', '.join(f'{name}={value:.4f}' for name, value in fit['params'].items())
+            print(f"{surgery_type}: {result['best']}({params}), chi-square p = {fit['p_value']:.4f}, "
+                  f"KS = {fit['ks_statistic']:.4f}")
+    else:
+        # Create detailed tables
+        create_detailed_tables(results)
     
-    print("\nAnalysis complete! Check 'surgery_analysis.png' for plots.")
\ No newline at end of file
+    print("\nAnalysis complete!")
+    if args.plot is not None:
+        print(f"Plots saved in '{args.plot}'.")
+    print(f"Fitted surgery time distributions written to {args.params}")
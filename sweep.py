@@ -0,0 +1,76 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from replications import replication_seeds, run_replication
+from scenarios import build_scenario, expand_grid, flatten_scenario, load_scenarios
+
+
+def run_scenario_replication(scenario_id, scenario, replication, seed, simulation_end_time):
+    return scenario_id, replication, seed, run_replication(simulation_end_time, seed, scenario)
+
+
+def sweep(scenarios, replications=5, simulation_end_time=43200, seed=100, workers=None):
+    # every scenario reuses the same replication seeds (common random numbers);
+    # rows are yielded in tidy form as soon as each replication finishes
+    for scenario in scenarios:
+        # a bad grid value fails here instead of in the middle of the sweep
+        build_scenario(scenario)
+    seeds = replication_seeds(seed, replications)
+    parameters = [flatten_scenario(scenario) for scenario in scenarios]
+    columns = sorted({key for flat in parameters for key in flat})
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(run_scenario_replication, scenario_id, scenario, replication,
+                                   replication_seed, simulation_end_time)
+                   for scenario_id, scenario in enumerate(scenarios)
+                   for replication, replication_seed in enumerate(seeds)]
+        for future in as_completed(futures):
+            scenario_id, replication, replication_seed, statistics = future.result()
+            scenario_columns = {column: parameters[scenario_id].get(column, '') for column in columns}
+            for kpi, value in statistics.items():
+                yield {
+                    'scenario': scenario_id,
+                    **scenario_columns,
+                    'replication': replication,
+                    'seed': replication_seed,
+                    'kpi': kpi,
+                    'value': '' if value is None else value
+                }
+
+
+def parse_grid_option(option):
+    # "capacities.ICU=15,18,21" -> ('capacities.ICU', [15, 18, 21])
+    key, values = option.split('=', 1)
+    return key, [json.loads(value) for value in values.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the hospital simulation over scenario configurations")
+    parser.add_argument('--config', help="JSON file with a 'grid' or a 'scenarios' list")
+    parser.add_argument('--grid', action='append', default=[], metavar='SETTING=V1,V2,...',
+                        help="grid axis such as capacities.ICU=15,18,21 (repeatable)")
+    parser.add_argument('--replications', type=int, default=5)
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help="CSV file for the KPI table (default: stdout)")
+    args = parser.parse_args()
+
+    if args.config:
+        scenarios = load_scenarios(args.config)
+    else:
+        scenarios = expand_grid(dict(parse_grid_option(option) for option in args.grid))
+
+    output = open(args.output, 'w', newline='') if args.output else sys.stdout
+    writer = None
+    for row in sweep(scenarios, args.replications, args.days * 24 * 60, args.seed, args.workers):
+        if writer is None:
+            writer = csv.DictWriter(output, fieldnames=list(row.keys()))
+            writer.writeheader()
+        writer.writerow(row)
+        output.flush()
+    if args.output:
+        output.close()
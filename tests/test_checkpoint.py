@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from simulation import HospitalSimulation
+from trace_sinks import CSVTraceSink, ExcelTraceSink, MemoryTraceSink
+
+END_TIME = 5 * 1440
+
+
+def make_sink(kind, path):
+    return MemoryTraceSink() if kind == 'memory' else CSVTraceSink(path, batch_size=500)
+
+
+def read_trace(sim, kind, path):
+    if kind == 'memory':
+        return sim.trace_sink.rows
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('rng_backend', ['scalar', 'buffered'])
+@pytest.mark.parametrize('kind', ['memory', 'csv'])
+def test_resumed_run_reproduces_the_trace(tmp_path, kind, rng_backend):
+    reference_path = str(tmp_path / 'reference.csv')
+    reference = HospitalSimulation(simulation_end_time=END_TIME, seed=11, rng_backend=rng_backend,
+                                   trace_sink=make_sink(kind, reference_path))
+    reference.simulate()
+
+    path = str(tmp_path / 'trace.csv')
+    checkpoint_path = str(tmp_path / 'sim.pkl')
+    interrupted = HospitalSimulation(simulation_end_time=END_TIME, seed=11, rng_backend=rng_backend,
+                                     trace_sink=make_sink(kind, path))
+    interrupted.run_until(4 * 1440)
+    interrupted.checkpoint(checkpoint_path)
+    interrupted.simulate()
+
+    # the checkpoint holds the state at day 4; the resumed run redoes the last day
+    resumed = HospitalSimulation.resume(checkpoint_path)
+    assert resumed.clock < END_TIME
+    resumed.simulate()
+
+    assert read_trace(resumed, kind, path) == read_trace(reference, kind, reference_path)
+    assert resumed.compute_statistics() == reference.compute_statistics()
+
+
+def test_checkpoint_interval_needs_a_path():
+    with pytest.raises(ValueError):
+        HospitalSimulation(checkpoint_interval=1440)
+
+
+def test_periodic_checkpoints_leave_the_trace_on_disk(tmp_path):
+    path = str(tmp_path / 'trace.csv')
+    checkpoint_path = str(tmp_path / 'sim.pkl')
+    sim = HospitalSimulation(simulation_end_time=20 * 1440, seed=11, trace_sink=CSVTraceSink(path),
+                             checkpoint_interval=5 * 1440, checkpoint_path=checkpoint_path)
+    sim.run_until(19 * 1440)
+    # the checkpoint holds the model state, not the trace rows written so far
+    assert os.path.getsize(checkpoint_path) < os.path.getsize(path) / 4
+
+
+def test_periodic_checkpoints_refuse_an_in_memory_trace(tmp_path):
+    checkpoint_path = str(tmp_path / 'sim.pkl')
+    with pytest.raises(ValueError):
+        HospitalSimulation(checkpoint_interval=1440, checkpoint_path=checkpoint_path)
+    with pytest.raises(ValueError):
+        HospitalSimulation(checkpoint_interval=1440, checkpoint_path=checkpoint_path, trace_sink=MemoryTraceSink())
+    sim = HospitalSimulation(simulation_end_time=3 * 1440, trace_level='off', checkpoint_interval=1440,
+                             checkpoint_path=checkpoint_path)
+    sim.simulate()
+    assert HospitalSimulation.resume(checkpoint_path).clock >= 2 * 1440
+
+
+def test_excel_trace_cannot_be_checkpointed(tmp_path):
+    with pytest.raises(ValueError):
+        HospitalSimulation(checkpoint_interval=1440, checkpoint_path=str(tmp_path / 'sim.pkl'),
+                           trace_sink=ExcelTraceSink(str(tmp_path / 'trace.xlsx')))
@@ -0,0 +1,42 @@
+import json
+import os
+
+import pytest
+
+from scenarios import LEGACY_SURGERY_TIME_PARAMS
+from simulation import HospitalSimulation
+
+# A 7-day run of the original simulation.py (first commit, default seed):
+# its first 500 trace rows, every 100th after and the last, the statistics
+# it printed, and the full-precision compute_statistics() of the same
+# legacy run
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'data', 'legacy_baseline.json')
+
+
+@pytest.fixture(scope='module')
+def baseline():
+    with open(BASELINE_PATH) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def legacy_run(baseline):
+    sim = HospitalSimulation(simulation_end_time=baseline['simulation_end_time'], rng_streams='shared',
+                             surgery_time_params=LEGACY_SURGERY_TIME_PARAMS)
+    sim.simulate()
+    return sim
+
+
+def test_legacy_run_reproduces_the_baseline_trace(baseline, legacy_run):
+    trace = legacy_run.trace_table
+    # the stored rows end with the last one
+    assert len(trace) == max(int(i) for i in baseline['rows']) + 1
+    for i, values in baseline['rows'].items():
+        row = trace[int(i)]
+        assert [row[column] for column in baseline['columns']] == values, f"trace row {i}"
+
+
+def test_legacy_run_reproduces_the_baseline_statistics(baseline, legacy_run, capsys):
+    assert legacy_run.compute_statistics() == baseline['statistics']
+    legacy_run.print_statistics()
+    assert capsys.readouterr().out == baseline['printed_statistics']
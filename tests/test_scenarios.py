@@ -0,0 +1,22 @@
+import pytest
+
+from scenarios import build_scenario
+from simulation import HospitalSimulation
+
+
+@pytest.mark.parametrize('overrides', [
+    {'capacities': {'ICU': -1}},
+    {'capacities': {'Ward': 2.5}},
+    {'outage_coverage': {'CCU': 1.5}},
+])
+def test_invalid_scenario_values_are_rejected(overrides):
+    with pytest.raises(ValueError):
+        build_scenario(overrides)
+
+
+def test_zero_capacity_reports_no_utilization():
+    sim = HospitalSimulation(simulation_end_time=3 * 1440, capacities={'ICU': 0}, trace_level='off')
+    sim.simulate()
+    statistics = sim.compute_statistics()
+    assert statistics['ICU Utilization'] is None
+    assert statistics['CCU Utilization'] is not None
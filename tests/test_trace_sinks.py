@@ -0,0 +1,49 @@
+import pytest
+
+from simulation import HospitalSimulation
+from trace_sinks import ExcelTraceSink, MemoryTraceSink, ParquetTraceSink
+
+
+def aggregate_rows(sink, bucket):
+    sim = HospitalSimulation(simulation_end_time=3 * 1440, seed=7, trace_level='aggregate',
+                             trace_sink=sink, trace_bucket=bucket)
+    sim.simulate()
+    return sink
+
+
+@pytest.mark.parametrize('bucket', [60, 37.5])
+def test_aggregate_rows_round_trip_through_parquet(tmp_path, bucket):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'trace.parquet')
+    aggregate_rows(ParquetTraceSink(path, batch_size=10), bucket)
+    expected = aggregate_rows(MemoryTraceSink(), bucket).rows
+
+    table = pq.read_table(path)
+    assert table.to_pylist() == expected
+    for column in expected[0]:
+        if column.startswith('Bucket') or column.endswith('Mean'):
+            assert str(table.schema.field(column).type) == 'double'
+
+
+def test_excel_trace_stays_open_until_the_run_is_finished(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    path = str(tmp_path / 'trace.xlsx')
+    sim = HospitalSimulation(simulation_end_time=2 * 1440, seed=7, trace_sink=ExcelTraceSink(path, sample_size=50))
+    sim.run_until(500)
+    sim.finish()
+    sim.step(10)
+    sim.stop()
+    sim.simulate()
+    reference = HospitalSimulation(simulation_end_time=2 * 1440, seed=7)
+    reference.simulate()
+
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    # the trace stays the first sheet, so pd.read_excel(path) reads it
+    assert workbook.sheetnames == ['Trace Table', 'Summary']
+    sheet = workbook['Trace Table']
+    rows = list(sheet.iter_rows(values_only=True))
+    assert len(rows) == len(reference.trace_table) + 1
+    assert rows[-1] == tuple(None if value == '' else value for value in reference.trace_table[-1].values())
+
+    with pytest.raises(ValueError):
+        sim.trace_sink.write(reference.trace_table[-1])
@@ -0,0 +1,352 @@
+import csv
+import math
+import os
+
+
+TRACE_LEVELS = ('off', 'summary', 'full', 'aggregate')
+
+EXCEL_MAX_ROWS = 1048576
+
+
+class AggregateTrace:
+    # The 'aggregate' trace level: instead of one row per event, one row per
+    # bucket of simulated time with the min, max and time-weighted mean
+    # queue length and busy beds of every department, plus how many patients
+    # arrived (were admitted), departed, died, needed re-surgery or were
+    # turned away in the bucket. record() is called before each event's
+    # handler runs, when the department state is the one held since the
+    # previous event.
+    FLOWS = ('Arrivals', 'Departures', 'Deaths', 'Re-surgeries', 'Turned Away')
+
+    def __init__(self, sim, bucket=60):
+        self.sim = sim
+        self.bucket = bucket
+        self.departments = list(sim.departments)
+        self.time = 0
+        self.bucket_start = 0
+        self.bucket_end = bucket
+        self.start_bucket()
+        # running totals, re-based when the warm-up reset replaces the statistics
+        self.completed = sim.completed_patients
+        self.departed = 0
+        self.in_system = 0
+        self.resurgeries = 0
+        self.turned_away = 0
+
+    def start_bucket(self):
+        count = 2 * len(self.departments)
+        self.minimum = [math.inf] * count
+        self.maximum = [-math.inf] * count
+        self.integral = [0.0] * count
+        self.flows = dict.fromkeys(self.FLOWS, 0)
+
+    def state(self):
+        sim = self.sim
+        return ([len(sim.queues[name]) for name in self.departments] +
+                [sim.departments[name].busy_beds for name in self.departments])
+
+    def accumulate(self, values, dt):
+        minimum, maximum, integral = self.minimum, self.maximum, self.integral
+        for i, value in enumerate(values):
+            if value < minimum[i]:
+                minimum[i] = value
+            if value > maximum[i]:
+                maximum[i] = value
+            integral[i] += value * dt
+
+    def count_flows(self):
+        sim = self.sim
+        if sim.completed_patients is not self.completed:
+            self.completed = sim.completed_patients
+            self.departed = self.resurgeries = self.turned_away = 0
+        flows = self.flows
+        departed = len(self.completed)
+        if departed != self.departed:
+            outcomes = self.completed['outcome'][self.departed:departed]
+            flows['Departures'] += departed - self.departed
+            flows['Deaths'] += int((outcomes == self.completed.OUTCOMES.index('Died')).sum())
+        in_system = len(sim.patient_stats)
+        flows['Arrivals'] += in_system - self.in_system + departed - self.departed
+        flows['Re-surgeries'] += sim.resurgery_count - self.resurgeries
+        flows['Turned Away'] += sim.emergency_full_count - self.turned_away
+        self.departed = departed
+        self.in_system = in_system
+        self.resurgeries = sim.resurgery_count
+        self.turned_away = sim.emergency_full_count
+
+    def emit(self, end):
+        duration = end - self.bucket_start
+        # bounds and means are always floats, so typed sinks store them as such
+        row = {'Bucket Start': float(self.bucket_start), 'Bucket End': round(float(end), 2)}
+        n = len(self.departments)
+        for kind, offset in (('Queue', 0), ('Busy', n)):
+            for k, name in enumerate(self.departments):
+                i = offset + k
+                row[f'{name} {kind} Min'] = self.minimum[i]
+                row[f'{name} {kind} Max'] = self.maximum[i]
+                row[f'{name} {kind} Mean'] = (round(self.integral[i] / duration, 4) if duration > 0
+                                               else float(self.minimum[i]))
+        row.update(self.flows)
+        self.sim.trace_sink.write(row)
+
+    def record(self):
+        # flows caused by the previous event belong to the bucket it fell in
+        self.count_flows()
+        clock = self.sim.clock
+        values = self.state()
+        while clock >= self.bucket_end:
+            self.accumulate(values, self.bucket_end - self.time)
+            self.emit(self.bucket_end)
+            self.time = self.bucket_start = self.bucket_end
+            self.bucket_end += self.bucket
+            self.start_bucket()
+        self.accumulate(values, clock - self.time)
+        self.time = clock
+
+    def finish(self, end_time):
+        # emits the last, possibly partial, bucket up to end_time
+        self.count_flows()
+        values = self.state()
+        while end_time > self.bucket_start:
+            end = min(end_time, self.bucket_end)
+            self.accumulate(values, end - self.time)
+            self.emit(end)
+            self.time = self.bucket_start = end
+            self.bucket_end = end + self.bucket
+            self.start_bucket()
+
+
+class MemoryTraceSink:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+
+    def close(self):
+        pass
+
+
+class CSVTraceSink:
+    def __init__(self, path, batch_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch = []
+        self.fieldnames = None
+        self.offset = 0
+        self.file = None
+        self.writer = None
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        if self.writer is None:
+            if self.fieldnames is None:
+                self.fieldnames = list(self.batch[0].keys())
+                self.file = open(self.path, 'w', newline='')
+                self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames)
+                self.writer.writeheader()
+            else:
+                # a run continued after simulate() closed the sink
+                self.file = open(self.path, 'a', newline='')
+                self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames)
+        self.writer.writerows(self.batch)
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.writer = None
+
+    def __getstate__(self):
+        # a checkpoint remembers how far the file was written
+        self.flush()
+        if self.file is not None:
+            self.file.flush()
+            self.offset = self.file.tell()
+        state = self.__dict__.copy()
+        state['file'] = None
+        state['writer'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.fieldnames is not None:
+            # rows written after the checkpoint are dropped before appending
+            self.file = open(self.path, 'r+', newline='')
+            self.file.truncate(self.offset)
+            self.file.seek(self.offset)
+            self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames)
+
+
+class ParquetTraceSink:
+    # A parquet file is only readable once its writer is closed, so every
+    # checkpoint closes the current file and later rows go to a new part:
+    # trace.parquet, trace.part1.parquet, trace.part2.parquet, ...
+    def __init__(self, path, batch_size=50000):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch = []
+        self.schema = None
+        self.part = 0
+        self.writer = None
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def column_type(self, pa, column, values):
+        # the trace uses '' for missing values, so a column's type comes from
+        # the values present in the first batch and, for a column that is
+        # still empty there, from its name
+        present = [value for value in values if value != '' and value is not None]
+        if any(isinstance(value, str) for value in present) or (not present and column.endswith('Type')):
+            return pa.string()
+        if any(isinstance(value, float) for value in present) or column == 'Clock' or 'Time' in column:
+            return pa.float64()
+        return pa.int64()
+
+    def part_path(self, part):
+        if part == 0:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return f'{root}.part{part}{ext}'
+
+    def flush(self):
+        if not self.batch:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.schema is None:
+            self.schema = pa.schema([(column, self.column_type(pa, column, [row.get(column) for row in self.batch]))
+                                     for column in self.batch[0]])
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.part_path(self.part), self.schema)
+        rows = [{key: (None if value == '' else value) for key, value in row.items()} for row in self.batch]
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.part += 1
+
+    def __getstate__(self):
+        self.close()
+        state = self.__dict__.copy()
+        state['writer'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        part = self.part
+        while os.path.exists(self.part_path(part)):
+            # parts written after the checkpoint are replaced by the resumed run
+            os.remove(self.part_path(part))
+            part += 1
+
+
+class ExcelTraceSink:
+    # Streams the trace into an .xlsx file with xlsxwriter's constant_memory
+    # mode, so each row goes to disk as it is written. Rows that do not fit
+    # on one sheet continue on 'Trace Table 2', 'Trace Table 3', ... Column
+    # widths are computed from the first sample_size rows. If summary is set
+    # to a callable returning a KPI dict, the KPIs are written to a
+    # 'Summary' sheet after the trace sheets on close.
+    def __init__(self, path, sample_size=1000, max_rows=EXCEL_MAX_ROWS):
+        self.path = path
+        self.sample_size = sample_size
+        self.rows_per_sheet = max_rows - 1
+        self.summary = None
+        self.sample = []
+        self.columns = None
+        self.widths = None
+        self.workbook = None
+        self.header_format = None
+        self.sheet = None
+        self.sheets = 0
+        self.row = 0
+
+    def write(self, row):
+        if self.widths is not None:
+            self.write_row(row)
+            return
+        self.sample.append(row)
+        if len(self.sample) >= self.sample_size:
+            self.flush_sample()
+
+    def flush_sample(self):
+        if not self.sample:
+            return
+        import xlsxwriter
+
+        self.columns = list(self.sample[0].keys())
+        self.widths = [
+            min(max(len(column), *(len(str(row[column])) for row in self.sample)) + 2, 50)
+            for column in self.columns
+        ]
+        self.workbook = xlsxwriter.Workbook(self.path, {'constant_memory': True})
+        self.header_format = self.workbook.add_format({'bold': True})
+        sample, self.sample = self.sample, []
+        for row in sample:
+            self.write_row(row)
+
+    def new_sheet(self):
+        if self.workbook is None:
+            raise ValueError(f"the Excel trace {self.path} is closed; an .xlsx file cannot be appended to")
+        self.sheets += 1
+        name = 'Trace Table' if self.sheets == 1 else f'Trace Table {self.sheets}'
+        self.sheet = self.workbook.add_worksheet(name)
+        for i, width in enumerate(self.widths):
+            self.sheet.set_column(i, i, width)
+        self.sheet.write_row(0, 0, self.columns, self.header_format)
+        self.sheet.freeze_panes(1, 0)
+        self.row = 0
+
+    def write_row(self, row):
+        if self.sheet is None or self.row == self.rows_per_sheet:
+            self.new_sheet()
+        self.row += 1
+        self.sheet.write_row(self.row, 0, list(row.values()))
+
+    def close(self):
+        self.flush_sample()
+        if self.workbook is None:
+            return
+        if self.summary is not None:
+            summary_sheet = self.workbook.add_worksheet('Summary')
+            summary_sheet.set_column(0, 0, 45)
+            summary_sheet.set_column(1, 1, 15)
+            summary_sheet.write_row(0, 0, ['KPI', 'Value'], self.header_format)
+            for i, (kpi, value) in enumerate(self.summary().items(), 1):
+                summary_sheet.write_row(i, 0, [kpi, '' if value is None else value])
+        self.workbook.close()
+        self.workbook = None
+        self.sheet = None
+
+    def __getstate__(self):
+        raise TypeError("an Excel trace cannot be resumed from a checkpoint; use a CSV or Parquet trace")
+
+
+def create_trace_sink(path=None, batch_size=None):
+    if path is None:
+        return MemoryTraceSink()
+    kwargs = {} if batch_size is None else {'batch_size': batch_size}
+    if path.endswith('.parquet'):
+        return ParquetTraceSink(path, **kwargs)
+    if path.endswith('.csv'):
+        return CSVTraceSink(path, **kwargs)
+    if path.endswith('.xlsx'):
+        return ExcelTraceSink(path)
+    raise ValueError(f"Unsupported trace file type: {path}")